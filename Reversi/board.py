@@ -1,101 +1,273 @@
 """A game-specific implementations of utility functions.
+
+The board is kept as two 64 bit integers (one per color) - square (x, y) is bit number x * 8 + y.
 """
 from __future__ import print_function, division
 from .consts import *
+import random
+
+#===============================================================================
+# Bitboard helpers
+#===============================================================================
+
+FULL_MASK = (1 << (BOARD_ROWS * BOARD_COLS)) - 1
+
+# Squares with y == 0 / y == 7. Shifting by a direction with dy != 0 wraps those into the neighbouring column.
+_Y0_MASK = sum(1 << (x * BOARD_ROWS) for x in range(BOARD_COLS))
+_Y7_MASK = _Y0_MASK << (BOARD_ROWS - 1)
+
+# (shift, mask) per direction: shifting a bitboard by `shift` and masking with `mask` moves every disc one step.
+DIRECTIONS = []
+for _dx, _dy in [[0, 1], [1, 1], [1, 0], [1, -1], [0, -1], [-1, -1], [-1, 0], [-1, 1]]:
+    _mask = FULL_MASK
+    if _dy == 1:
+        _mask &= ~_Y0_MASK
+    elif _dy == -1:
+        _mask &= ~_Y7_MASK
+    DIRECTIONS.append((_dx * BOARD_ROWS + _dy, _mask))
+
+SQUARE_BITS = [1 << i for i in range(BOARD_ROWS * BOARD_COLS)]
+STARTING_DISCS = {
+    X_PLAYER: SQUARE_BITS[3 * 8 + 3] | SQUARE_BITS[4 * 8 + 4],
+    O_PLAYER: SQUARE_BITS[3 * 8 + 4] | SQUARE_BITS[4 * 8 + 3],
+}
+
+# Zobrist keys: a random 64 bit number per (color, square), and one for O to move.
+# A position's key is the xor of the keys of its discs (and side to move), so it can be updated per flipped disc.
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_SQUARE_KEYS = {
+    X_PLAYER: [_zobrist_random.getrandbits(64) for _ in SQUARE_BITS],
+    O_PLAYER: [_zobrist_random.getrandbits(64) for _ in SQUARE_BITS],
+}
+ZOBRIST_FLIP_KEYS = [x_key ^ o_key for x_key, o_key in zip(ZOBRIST_SQUARE_KEYS[X_PLAYER], ZOBRIST_SQUARE_KEYS[O_PLAYER])]
+ZOBRIST_SIDE_KEY = _zobrist_random.getrandbits(64)
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def iter_squares(bits):
+    """Yields the indices of the set bits, lowest first (which is the row-major [x][y] order)."""
+    while bits:
+        lsb = bits & -bits
+        yield lsb.bit_length() - 1
+        bits ^= lsb
+
+
+def get_moves_mask(own, opp):
+    """Returns a bitboard of all the legal moves for the player owning `own`."""
+    empty = ~(own | opp) & FULL_MASK
+    moves = 0
+    for shift, mask in DIRECTIONS:
+        if shift > 0:
+            t = (own << shift) & mask & opp
+            t |= (t << shift) & mask & opp
+            t |= (t << shift) & mask & opp
+            t |= (t << shift) & mask & opp
+            t |= (t << shift) & mask & opp
+            t |= (t << shift) & mask & opp
+            moves |= (t << shift) & mask & empty
+        else:
+            shift = -shift
+            t = (own >> shift) & mask & opp
+            t |= (t >> shift) & mask & opp
+            t |= (t >> shift) & mask & opp
+            t |= (t >> shift) & mask & opp
+            t |= (t >> shift) & mask & opp
+            t |= (t >> shift) & mask & opp
+            moves |= (t >> shift) & mask & empty
+    return moves
+
+
+def get_zobrist_key(discs, curr_player):
+    """Computes the Zobrist key of a position from scratch.
+
+    :param discs: A dict from color to its bitboard.
+    :param curr_player: The player to move.
+    """
+    key = ZOBRIST_SIDE_KEY if curr_player == O_PLAYER else 0
+    for color in (X_PLAYER, O_PLAYER):
+        square_keys = ZOBRIST_SQUARE_KEYS[color]
+        for i in iter_squares(discs[color]):
+            key ^= square_keys[i]
+    return key
+
+
+def get_flips_mask(own, opp, square):
+    """Returns a bitboard of the discs flipped by placing a disc on `square` (0 if the move is illegal).
+    Does not check the square is empty.
+    """
+    flips = 0
+    for shift, mask in DIRECTIONS:
+        line = 0
+        if shift > 0:
+            b = (SQUARE_BITS[square] << shift) & mask
+            while b & opp:
+                line |= b
+                b = (b << shift) & mask
+        else:
+            b = (SQUARE_BITS[square] >> -shift) & mask
+            while b & opp:
+                line |= b
+                b = (b >> -shift) & mask
+        if b & own:
+            flips |= line
+    return flips
+
+
+# The character of an empty square in board strings
+EMPTY_CHAR = '-'
+
 
 class GameState:
     def __init__(self):
         """ Initializing the board and current player.
         """
-        self.board = []
-        for i in range(BOARD_COLS):
-            self.board.append([EM] * BOARD_ROWS)
+        # Starting pieces:
+        self.discs = dict(STARTING_DISCS)
+
+        self._curr_player = X_PLAYER
+        self._key = get_zobrist_key(self.discs, self._curr_player)
+
+    @classmethod
+    def from_string(cls, text):
+        """Loads a state from a board string, as written by to_string: 64 characters, one per square in bit order
+        (square (x, y) is character x * 8 + y), each X_PLAYER, O_PLAYER or '-', then the player to move.
+        Whitespace is ignored, so the squares may be split into lines.
+
+        :raises ValueError: If the string is not a board string.
+        """
+        chars = ''.join(text.split())
+        squares, player = chars[:-1], chars[-1:]
+        if len(squares) != BOARD_ROWS * BOARD_COLS or player not in (X_PLAYER, O_PLAYER) or \
+                not set(squares) <= {X_PLAYER, O_PLAYER, EMPTY_CHAR}:
+            raise ValueError('Not a board string: {!r}'.format(text))
 
+        state = cls()
+        state.discs = {color: sum(SQUARE_BITS[i] for i, char in enumerate(squares) if char == color)
+                       for color in (X_PLAYER, O_PLAYER)}
+        state._curr_player = player
+        state._key = get_zobrist_key(state.discs, player)
+        return state
+
+    def to_string(self):
+        """Returns the board string of this state, which from_string loads back."""
+        x_discs = self.discs[X_PLAYER]
+        o_discs = self.discs[O_PLAYER]
+        return ''.join(X_PLAYER if x_discs & bit else (O_PLAYER if o_discs & bit else EMPTY_CHAR)
+                       for bit in SQUARE_BITS) + self._curr_player
+
+    @property
+    def curr_player(self):
+        return self._curr_player
+
+    @curr_player.setter
+    def curr_player(self, player):
+        # The searches set the player to move directly, so the key has to follow.
+        if player != self._curr_player:
+            self._key ^= ZOBRIST_SIDE_KEY
+            self._curr_player = player
+
+    @property
+    def zobrist_key(self):
+        """A 64 bit Zobrist key of the position (discs and player to move), kept up to date incrementally."""
+        return self._key
+
+    @property
+    def board(self):
+        """A list-of-lists view of the board, board[x][y] is EM, X_PLAYER or O_PLAYER.
+        This is a fresh copy - changing it does not change the state.
+        """
+        x_discs = self.discs[X_PLAYER]
+        o_discs = self.discs[O_PLAYER]
+        board = []
         for x in range(BOARD_COLS):
+            column = []
             for y in range(BOARD_ROWS):
-                self.board[x][y] = EM
-        
-        # Starting pieces:
-        self.board[3][3] = X_PLAYER
-        self.board[3][4] = O_PLAYER
-        self.board[4][3] = O_PLAYER
-        self.board[4][4] = X_PLAYER
-                    
-        self.curr_player = X_PLAYER
-    
+                bit = SQUARE_BITS[x * BOARD_ROWS + y]
+                column.append(X_PLAYER if x_discs & bit else (O_PLAYER if o_discs & bit else EM))
+            board.append(column)
+        return board
+
+    @property
+    def disc_count(self):
+        """The number of discs on the board (4 + the number of moves played)."""
+        return popcount(self.discs[X_PLAYER] | self.discs[O_PLAYER])
+
     def isOnBoard(self, x, y):
     # Returns True if the coordinates are located on the board.
         return x >= 0 and x <= 7 and y >= 0 and y <=7
 
     def isValidMove(self, xstart, ystart):
-        if self.board[xstart][ystart] != EM or not self.isOnBoard(xstart, ystart):
+        if not self.isOnBoard(xstart, ystart):
             return False
 
-        self.board[xstart][ystart] = self.curr_player # temporarily set the tile on the board.
-
-        tilesToFlip = []
-        for xdirection, ydirection in [[0, 1], [1, 1], [1, 0], [1, -1], [0, -1], [-1, -1], [-1, 0], [-1, 1]]:
-            x, y = xstart, ystart
-            x += xdirection # first step in the direction
-            y += ydirection # first step in the direction
-            if self.isOnBoard(x, y) and self.board[x][y] == OPPONENT_COLOR[self.curr_player]:
-                # There is a piece belonging to the other player next to our piece.
-                x += xdirection
-                y += ydirection
-                if not self.isOnBoard(x, y):
-                    continue
-                while self.board[x][y] == OPPONENT_COLOR[self.curr_player]:
-                    x += xdirection
-                    y += ydirection
-                    if not self.isOnBoard(x, y): # break out of while loop, then continue in for loop
-                        break
-                if not self.isOnBoard(x, y):
-                    continue
-                if self.board[x][y] == self.curr_player:
-                    # There are pieces to flip over. Go in the reverse direction until we reach the original space, noting all the tiles along the way.
-                    while True:
-                        x -= xdirection
-                        y -= ydirection
-                        if x == xstart and y == ystart:
-                            break
-                        tilesToFlip.append([x, y])
-
-        self.board[xstart][ystart] = EM # restore the empty space
-        if len(tilesToFlip) == 0: # If no tiles were flipped, this is not a valid move.
+        own = self.discs[self.curr_player]
+        opp = self.discs[OPPONENT_COLOR[self.curr_player]]
+        square = xstart * BOARD_ROWS + ystart
+        if (own | opp) & SQUARE_BITS[square]:
             return False
-        return tilesToFlip
 
+        flips = get_flips_mask(own, opp, square)
+        if not flips: # If no tiles were flipped, this is not a valid move.
+            return False
+        return [[i >> 3, i & 7] for i in iter_squares(flips)]
 
     def get_possible_moves(self):
-        validMoves = []
+        player = self._curr_player
+        moves = get_moves_mask(self.discs[player], self.discs[OPPONENT_COLOR[player]])
+        return [[i >> 3, i & 7] for i in iter_squares(moves)]
 
-        for x in range(BOARD_COLS):
-            for y in range(BOARD_ROWS):
-                if self.isValidMove(x, y) != False:
-                    validMoves.append([x, y])
-        return validMoves
+    def perform_move(self, xstart, ystart):
+        return self.make_move(xstart, ystart) is not None
+
+    def make_move(self, xstart, ystart):
+        """Performs a move in place, like perform_move, but returns an undo record for unmake_move.
+
+        :return: The undo record, or None if the move is not valid (the state is then unchanged).
+        """
+        if not self.isOnBoard(xstart, ystart):
+            return None
+
+        player = self._curr_player
+        opp_color = OPPONENT_COLOR[player]
+        own = self.discs[player]
+        opp = self.discs[opp_color]
+        square_bit = SQUARE_BITS[xstart * BOARD_ROWS + ystart]
+        if (own | opp) & square_bit:
+            return None
+
+        flips = get_flips_mask(own, opp, xstart * BOARD_ROWS + ystart)
+        if not flips:
+            return None
+
+        key = self._key
+        new_key = key ^ ZOBRIST_SQUARE_KEYS[player][xstart * BOARD_ROWS + ystart] ^ ZOBRIST_SIDE_KEY
+        for i in iter_squares(flips):
+            new_key ^= ZOBRIST_FLIP_KEYS[i]
+
+        self.discs[player] = own | flips | square_bit
+        self.discs[opp_color] = opp ^ flips
+        self._curr_player = opp_color
+        self._key = new_key
+        return square_bit, flips, player, key
+
+    def unmake_move(self, undo):
+        """Takes back a move done by make_move. Moves must be taken back in reverse order.
+
+        :param undo: The record returned by make_move.
+        """
+        square_bit, flips, player, key = undo
+        opp_color = OPPONENT_COLOR[player]
+        self.discs[player] ^= flips | square_bit
+        self.discs[opp_color] |= flips
+        self._curr_player = player
+        self._key = key
 
-    def perform_move(self, xstart, ystart):       
-        tilesToFlip = self.isValidMove(xstart, ystart)
-        if tilesToFlip == False:
-            return False
-        
-        self.board[xstart][ystart] = self.curr_player
-        for x, y in tilesToFlip:
-            self.board[x][y] = self.curr_player
-        # Updating the current player.
-        self.curr_player = OPPONENT_COLOR[self.curr_player]
-        return True
-    
     def get_winner(self):
-        my_u = 0
-        op_u = 0
-        for x in range(BOARD_COLS):
-            for y in range(BOARD_ROWS):
-                if self.board[x][y] == self.curr_player:
-                    my_u += 1
-                if self.board[x][y] == OPPONENT_COLOR[self.curr_player]:
-                    op_u += 1
+        my_u = popcount(self.discs[self.curr_player])
+        op_u = popcount(self.discs[OPPONENT_COLOR[self.curr_player]])
         if my_u > op_u:
             return self.curr_player
         elif my_u < op_u:
@@ -103,32 +275,44 @@ class GameState:
         else:
             return TIE
 
-        
+
     def draw_board(self):
     # This function prints out the board that it was passed. Returns None.
         HLINE = '  +---+---+---+---+---+---+---+---+'
         VLINE = '  |   |   |   |   |   |   |   |   |'
 
+        board = self.board
         print(HLINE)
         for y in range(BOARD_COLS):
             #print(VLINE)
             print(y, end=' ')
             for x in range(BOARD_ROWS):
-                print('| %s' % (self.board[x][y]), end=' ')
+                print('| %s' % (board[x][y]), end=' ')
             print('|')
             #print(VLINE)
             print(HLINE)
         print('    0   1   2   3   4   5   6   7')
         print("\n" + self.curr_player + " Player Turn!\n\n")
 
+    def copy(self):
+        """Returns an independent copy of the state. Much cheaper than copy.deepcopy's generic machinery."""
+        # The state is just a few immutable values, so a shallow clone is a deep copy.
+        state = self.__class__.__new__(self.__class__)
+        state.discs = dict(self.discs)
+        state._curr_player = self._curr_player
+        state._key = self._key
+        return state
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
     def __hash__(self):
         """This object can be inserted into a set or as dict key. NOTICE: Changing the object after it has been inserted
         into a set or dict (as key) may have unpredicted results!!!
         """
-        return hash(','.join([self.board[i][j]
-                              for i in range(BOARD_ROWS)
-                              for j in range(BOARD_COLS)] + [self.curr_player]))
+        return self._key
 
     def __eq__(self, other):
-        return isinstance(other, GameState) and self.board == other.board and self.curr_player == other.curr_player
+        return (isinstance(other, GameState) and self._key == other._key and self.discs == other.discs and
+                self._curr_player == other._curr_player)
 
@@ -0,0 +1,188 @@
+"""A compiled opening book: a binary hash table from position keys to book moves, memory-mapped at runtime.
+
+Compile it once from a book.gam file:
+
+    python -m Reversi.book book.gam book.bin
+
+Each book.gam line is a game, written as moves like '+f5-d6+c3...' (color sign, column letter, row digit).
+Every position reached in the first plies of every game is stored with the move played from it and the number of
+games playing it. Positions are keyed by their canonical form - the one of the 8 symmetries of the board with the
+smallest Zobrist key - so transpositions, rotations and mirror images of a book line all share the same records.
+A lookup is a single hash probe into the mapped file.
+"""
+from __future__ import print_function
+import collections
+import mmap
+import os
+import struct
+import sys
+from .board import GameState, SQUARE_BITS, ZOBRIST_SIDE_KEY, get_zobrist_key, iter_squares
+from .consts import BOARD_ROWS, BOARD_COLS
+
+MAGIC = b'RVBK'
+VERSION = 2
+# magic, version, book plies, number of slots (a power of 2), the Zobrist side key (so keys from other Zobrist tables
+# are refused)
+HEADER = struct.Struct('<4sHBxIQ')
+# canonical position key, number of games, move square (in the canonical board). A slot with 0 games is empty.
+RECORD = struct.Struct('<QIB3x')
+
+# How many plies of each game go into the book
+BOOK_PLIES = 10
+
+
+def _transform(square, symmetry):
+    """Applies one of the 8 board symmetries (0 is the identity) to a square index."""
+    x, y = divmod(square, BOARD_ROWS)
+    last = BOARD_ROWS - 1
+    if symmetry & 1:
+        x = last - x
+    if symmetry & 2:
+        y = last - y
+    if symmetry & 4:
+        x, y = y, x
+    return x * BOARD_ROWS + y
+
+
+# SYMMETRIES[s][square] is the square that `square` goes to under symmetry s
+SYMMETRIES = [[_transform(i, s) for i in range(BOARD_ROWS * BOARD_COLS)] for s in range(8)]
+# INVERSE_SYMMETRIES[s] is the symmetry undoing s
+INVERSE_SYMMETRIES = [next(t for t in range(8) if all(SYMMETRIES[t][j] == i for i, j in enumerate(SYMMETRIES[s])))
+                      for s in range(8)]
+
+
+def transform_discs(discs, symmetry):
+    """Applies a symmetry to a dict of bitboards."""
+    squares = SYMMETRIES[symmetry]
+    return {color: sum(SQUARE_BITS[squares[i]] for i in iter_squares(bits)) for color, bits in discs.items()}
+
+
+def canonical_key(discs, curr_player):
+    """Returns the canonical key of a position: the smallest Zobrist key over the 8 symmetries of the board.
+
+    :return: A tuple: (The canonical key, The symmetries taking the position to its canonical form). There is more
+             than one such symmetry when the position is itself symmetric, like the starting position.
+    """
+    keys = [get_zobrist_key(transform_discs(discs, symmetry), curr_player) for symmetry in range(8)]
+    key = min(keys)
+    return key, [symmetry for symmetry in range(8) if keys[symmetry] == key]
+
+
+def parse_line(line, plies=BOOK_PLIES):
+    """Parses the first plies of a book.gam line into [x, y] moves.
+
+    The book is written in standard notation, where the starting discs are mirrored compared to this board,
+    so the columns are mirrored (a <-> h).
+    """
+    moves = []
+    for i in range(0, min(len(line), 3 * plies) - 2, 3):
+        sign, column, row = line[i], line[i + 1], line[i + 2]
+        if sign not in '+-' or not 'a' <= column <= 'h' or not '1' <= row <= '8':
+            break
+        moves.append([BOARD_COLS - 1 - (ord(column) - ord('a')), int(row) - 1])
+    return moves
+
+
+def count_book_moves(lines, plies=BOOK_PLIES):
+    """Replays the book games and counts the moves played from every position.
+
+    :return: A Counter from (canonical position key, move square in the canonical board) to the number of games.
+    """
+    counts = collections.Counter()
+    for line in lines:
+        state = GameState()
+        for x, y in parse_line(line, plies):
+            discs, player = dict(state.discs), state.curr_player
+            if not state.perform_move(x, y):
+                break
+            key, symmetries = canonical_key(discs, player)
+            counts[key, SYMMETRIES[symmetries[0]][x * BOARD_ROWS + y]] += 1
+    return counts
+
+
+def compile_book(book_path, out_path, plies=BOOK_PLIES):
+    """Compiles a book.gam file into the binary index read by OpeningBook.
+
+    :return: The number of (position, move) records written.
+    """
+    with open(book_path, 'r') as f:
+        counts = count_book_moves(f, plies)
+
+    # Keep the table at most half full, so probes stay short
+    slots = 1
+    while slots < 2 * len(counts):
+        slots *= 2
+
+    table = [None] * slots
+    for (key, square), games in counts.items():
+        i = key & (slots - 1)
+        while table[i] is not None:
+            i = (i + 1) & (slots - 1)
+        table[i] = (key, games, square)
+
+    with open(out_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, plies, slots, ZOBRIST_SIDE_KEY))
+        empty = RECORD.pack(0, 0, 0)
+        for record in table:
+            f.write(RECORD.pack(*record) if record is not None else empty)
+
+    return len(counts)
+
+
+class OpeningBook:
+
+    def __init__(self, path):
+        """Memory-maps a book compiled by compile_book. Nothing is read until a lookup.
+
+        :raises ValueError: If the file is not a compiled book for this board.
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, plies, slots, side_key = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or side_key != ZOBRIST_SIDE_KEY:
+            raise ValueError('{} is not a compiled opening book for this board'.format(path))
+        # Positions after this many plies are never in the book
+        self.plies = plies
+        self._mask = slots - 1
+
+    @classmethod
+    def open(cls, path):
+        """Returns the book at the given path, or None if there is no compiled book there."""
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def lookup(self, state):
+        """Returns the book moves from the given state, in any move order or symmetry the book has.
+
+        :return: A list of ([x, y], number of games) tuples, the most played first. Empty if not in the book.
+        """
+        # The book only has the positions before its last ply (4 discs are on the board at the start)
+        if state.disc_count - 4 >= self.plies:
+            return []
+
+        key, symmetries = canonical_key(state.discs, state.curr_player)
+        to_state = [SYMMETRIES[INVERSE_SYMMETRIES[symmetry]] for symmetry in symmetries]
+        games_by_square = collections.Counter()
+        i = key & self._mask
+        while True:
+            record_key, games, square = RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+            if games == 0:
+                break
+            if record_key == key:
+                # In a symmetric position, a book move stands for all of its symmetric moves
+                for move_square in set(squares[square] for squares in to_state):
+                    games_by_square[move_square] += games
+            i = (i + 1) & self._mask
+        return [([square // BOARD_ROWS, square % BOARD_ROWS], games) for square, games in games_by_square.most_common()]
+
+    def close(self):
+        self._map.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Syntax: python -m Reversi.book book.gam book.bin')
+        sys.exit(1)
+    print('{} book moves written.'.format(compile_book(sys.argv[1], sys.argv[2])))
@@ -0,0 +1,150 @@
+"""A randomized differential tester of a game engine against the reference GameState (Reversi.reference).
+
+Random games are played through both, and at every ply the legal moves, the discs each move flips, the boards, the
+player to move and the Zobrist key are compared. Every move is also made and taken back before it's played, to check
+unmake_move. At the end of each game the winners are compared. The games are shared out over a process pool.
+
+    python -m Reversi.difftest [--games N] [--seed S] [--workers W] [--engine module:Class]
+"""
+from __future__ import print_function
+import argparse
+import importlib
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .board import get_zobrist_key, SQUARE_BITS
+from .consts import X_PLAYER, O_PLAYER, BOARD_ROWS, BOARD_COLS
+from .reference import ReferenceGameState
+
+DEFAULT_ENGINE = 'Reversi.board:GameState'
+
+# Games per pool task
+CHUNK_SIZE = 100
+
+
+def load_engine(path):
+    """Imports an engine class given as 'module:Class'."""
+    module_name, class_name = path.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _reference_discs(reference):
+    return {color: sum(SQUARE_BITS[x * BOARD_ROWS + y] for x in range(BOARD_COLS) for y in range(BOARD_ROWS)
+                       if reference.board[x][y] == color)
+            for color in (X_PLAYER, O_PLAYER)}
+
+
+def compare_ply(engine, reference):
+    """Compares the engine and the reference in their current position.
+
+    :return: A description of the first difference, or None if they agree.
+    """
+    if engine.board != reference.board:
+        return 'boards differ'
+    if engine.curr_player != reference.curr_player:
+        return 'players to move differ: {} != {}'.format(engine.curr_player, reference.curr_player)
+    if engine.zobrist_key != get_zobrist_key(_reference_discs(reference), reference.curr_player):
+        return 'zobrist key differs from the key computed from scratch'
+
+    moves = engine.get_possible_moves()
+    reference_moves = reference.get_possible_moves()
+    if moves != reference_moves:
+        return 'moves differ: {} != {}'.format(moves, reference_moves)
+
+    for x, y in moves:
+        flips = engine.isValidMove(x, y)
+        reference_flips = reference.isValidMove(x, y)
+        if sorted(flips) != sorted(reference_flips):
+            return 'flips of {} differ: {} != {}'.format([x, y], sorted(flips), sorted(reference_flips))
+
+        before = engine.copy()
+        undo = engine.make_move(x, y)
+        engine.unmake_move(undo)
+        if engine != before or engine.zobrist_key != before.zobrist_key:
+            return 'making and taking back {} changed the state'.format([x, y])
+    return None
+
+
+def play_game(seed, engine_class):
+    """Plays one random game through the engine and the reference, comparing them at every ply.
+
+    :return: A tuple: (The number of plies played, A description of the first difference or None).
+        The description includes the seed, ply and board string (GameState.to_string) to reproduce it.
+    """
+    rng = random.Random(seed)
+    engine = engine_class()
+    reference = ReferenceGameState()
+    ply = 0
+    while True:
+        difference = compare_ply(engine, reference)
+        if difference is not None:
+            return ply, 'seed {} ply {}: {} ({})'.format(seed, ply, difference, engine.to_string())
+
+        moves = reference.get_possible_moves()
+        if not moves:
+            break
+        x, y = rng.choice(moves)
+        if not engine.perform_move(x, y) or not reference.perform_move(x, y):
+            return ply, 'seed {} ply {}: {} was refused'.format(seed, ply, [x, y])
+        ply += 1
+
+    if engine.get_winner() != reference.get_winner():
+        return ply, 'seed {}: winners differ: {} != {}'.format(seed, engine.get_winner(), reference.get_winner())
+    return ply, None
+
+
+def play_games(first_seed, games, engine_path):
+    """Plays the games with seeds first_seed .. first_seed + games - 1. Runs in a pool worker.
+
+    :return: A tuple: (The number of plies played, The differences found).
+    """
+    engine_class = load_engine(engine_path)
+    plies = 0
+    differences = []
+    for seed in range(first_seed, first_seed + games):
+        game_plies, difference = play_game(seed, engine_class)
+        plies += game_plies
+        if difference is not None:
+            differences.append(difference)
+    return plies, differences
+
+
+def run(games, seed=0, engine_path=DEFAULT_ENGINE, max_workers=None):
+    """Plays the games over a process pool.
+
+    :return: A tuple: (The number of plies played, The differences found).
+    """
+    plies = 0
+    differences = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(play_games, first_seed, min(CHUNK_SIZE, seed + games - first_seed), engine_path)
+                   for first_seed in range(seed, seed + games, CHUNK_SIZE)]
+        for future in futures:
+            chunk_plies, chunk_differences = future.result()
+            plies += chunk_plies
+            differences.extend(chunk_differences)
+    return plies, differences
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Plays random games through an engine and the reference '
+                                                 'GameState, and compares them at every ply.')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the first game, the next get the next seeds')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size (default: number of CPUs)')
+    parser.add_argument('--engine', default=DEFAULT_ENGINE, help='the engine class, as module:Class')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    plies, differences = run(args.games, args.seed, args.engine, args.workers)
+    for difference in differences:
+        print(difference)
+    print('{} games, {} plies, {} differences ({:.1f}s)'.format(args.games, plies, len(differences),
+                                                                 time.time() - start))
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
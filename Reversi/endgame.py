@@ -0,0 +1,182 @@
+"""An exact endgame solver, working directly on the bitboards.
+
+In this game a player that has no moves ends the game (there are no passes), and the game is decided by the
+disc difference at that point. The solver scores positions by that final disc difference, from the point of view
+of the player to move.
+"""
+from .board import get_moves_mask, get_flips_mask, popcount, iter_squares, SQUARE_BITS, FULL_MASK
+from .consts import OPPONENT_COLOR, BOARD_ROWS, BOARD_COLS
+from .stability import get_stable_discs
+
+MAX_SCORE = BOARD_ROWS * BOARD_COLS
+
+# The board is split into 4 quadrants for parity ordering. The last empty square of a region is best played by us,
+# so moves in regions with an odd number of empties are tried first.
+QUADRANT_MASKS = [sum(SQUARE_BITS[x * BOARD_ROWS + y] for x in xs for y in ys)
+                  for xs in (range(0, 4), range(4, 8)) for ys in (range(0, 4), range(4, 8))]
+
+# From this many empties up, moves are ordered fastest-first (by the opponent's mobility after the move).
+FASTEST_FIRST_EMPTIES = 7
+# From this many empties up, the solver checks whether it ran out of time.
+TIME_CHECK_EMPTIES = 8
+
+
+class _TimeIsUp(Exception):
+    pass
+
+
+def _parity_mask(empties):
+    mask = 0
+    for quadrant in QUADRANT_MASKS:
+        if popcount(empties & quadrant) & 1:
+            mask |= quadrant
+    return mask
+
+
+class EndgameSolver:
+
+    def __init__(self, no_more_time=None, win_loss_draw=False):
+        """Initialize an endgame solver.
+
+        :param no_more_time: A function that returns true if there is no more time to run this search, or false if
+                             there is still time left. optional.
+        :param win_loss_draw: If True, only find out whether the position is won, lost or drawn, which is faster
+                              than finding the exact disc difference.
+        """
+        self.no_more_time = no_more_time
+        self.win_loss_draw = win_loss_draw
+        self.nodes = 0
+
+    def solve(self, state):
+        """Solves the given state for the player to move.
+
+        :param state: The GameState to solve. It is not changed.
+        :return: A tuple: (The final disc difference for the player to move - or in win/loss/draw mode, just a
+                 number with its sign, The best move), or None if there is no move or the time ran out.
+        """
+        own = state.discs[state.curr_player]
+        opp = state.discs[OPPONENT_COLOR[state.curr_player]]
+        alpha, beta = (-1, 1) if self.win_loss_draw else (-MAX_SCORE - 1, MAX_SCORE + 1)
+
+        moves = get_moves_mask(own, opp)
+        if not moves:
+            return None
+
+        n = popcount(~(own | opp) & FULL_MASK)
+        best_value, best_square = -MAX_SCORE - 1, None
+        try:
+            for square, flips in self._ordered_moves(own, opp, moves, n):
+                value = -self._solve(opp ^ flips, own | flips | SQUARE_BITS[square], -beta, -max(alpha, best_value),
+                                     n - 1)
+                if best_square is None or value > best_value:
+                    best_value, best_square = value, square
+                    if value >= beta:
+                        break
+        except _TimeIsUp:
+            return None
+
+        return best_value, [best_square // BOARD_ROWS, best_square % BOARD_ROWS]
+
+    def _ordered_moves(self, own, opp, moves, n):
+        """Returns the moves as (square, flips) tuples, ordered by parity, and fastest-first on larger boards."""
+        parity = _parity_mask(~(own | opp) & FULL_MASK)
+        ordered = []
+        for square in iter_squares(moves):
+            flips = get_flips_mask(own, opp, square)
+            odd_region = 0 if SQUARE_BITS[square] & parity else 1
+            if n >= FASTEST_FIRST_EMPTIES:
+                mobility = popcount(get_moves_mask(opp ^ flips, own | flips | SQUARE_BITS[square]))
+                ordered.append((mobility, odd_region, square, flips))
+            else:
+                ordered.append((0, odd_region, square, flips))
+        ordered.sort()
+        return [(square, flips) for _, _, square, flips in ordered]
+
+    def _solve(self, own, opp, alpha, beta, n):
+        """Fail-soft negamax alpha-beta over the n empties."""
+        self.nodes += 1
+        if n <= 4:
+            empties = ~(own | opp) & FULL_MASK
+            parity = _parity_mask(empties)
+            # Squares in odd regions first
+            squares = ([square for square in iter_squares(empties & parity)] +
+                       [square for square in iter_squares(empties & ~parity)])
+            return self._solve_few(own, opp, squares, alpha, beta)
+
+        if n >= TIME_CHECK_EMPTIES and self.no_more_time and self.no_more_time():
+            raise _TimeIsUp
+
+        # Stability cut-off: the opponent's stable discs are still theirs at the end, which caps our score. The stable
+        # discs are only looked for when even all of the opponent's discs being stable could fail low.
+        if alpha >= MAX_SCORE - 2 * popcount(opp):
+            upper_bound = MAX_SCORE - 2 * popcount(get_stable_discs(opp, own))
+            if upper_bound <= alpha:
+                return upper_bound
+
+        moves = get_moves_mask(own, opp)
+        if not moves:
+            return popcount(own) - popcount(opp)
+
+        best_value = -MAX_SCORE - 1
+        for square, flips in self._ordered_moves(own, opp, moves, n):
+            value = -self._solve(opp ^ flips, own | flips | SQUARE_BITS[square], -beta, -max(alpha, best_value), n - 1)
+            if value > best_value:
+                best_value = value
+                if value >= beta:
+                    break
+        return best_value
+
+    def _solve_few(self, own, opp, squares, alpha, beta):
+        """The last 3 or 4 empties: tries the given squares directly instead of generating moves."""
+        if len(squares) == 2:
+            return self._solve2(own, opp, squares[0], squares[1], alpha, beta)
+        if len(squares) == 1:
+            return self._solve1(own, opp, squares[0])
+
+        self.nodes += 1
+        best_value = None
+        for i, square in enumerate(squares):
+            flips = get_flips_mask(own, opp, square)
+            if not flips:
+                continue
+            rest = squares[:i] + squares[i + 1:]
+            value = -self._solve_few(opp ^ flips, own | flips | SQUARE_BITS[square], rest,
+                                     -beta, -(alpha if best_value is None else max(alpha, best_value)))
+            if best_value is None or value > best_value:
+                best_value = value
+                if value >= beta:
+                    break
+
+        if best_value is None:
+            return popcount(own) - popcount(opp)
+        return best_value
+
+    def _solve2(self, own, opp, square1, square2, alpha, beta):
+        """The last 2 empties."""
+        self.nodes += 1
+        best_value = None
+
+        flips = get_flips_mask(own, opp, square1)
+        if flips:
+            best_value = -self._solve1(opp ^ flips, own | flips | SQUARE_BITS[square1], square2)
+            if best_value >= beta:
+                return best_value
+
+        flips = get_flips_mask(own, opp, square2)
+        if flips:
+            value = -self._solve1(opp ^ flips, own | flips | SQUARE_BITS[square2], square1)
+            if best_value is None or value > best_value:
+                best_value = value
+
+        if best_value is None:
+            return popcount(own) - popcount(opp)
+        return best_value
+
+    def _solve1(self, own, opp, square):
+        """The last empty: the game ends after this move, or right away if it's not a legal move."""
+        self.nodes += 1
+        diff = popcount(own) - popcount(opp)
+        flips = get_flips_mask(own, opp, square)
+        if flips:
+            return diff + 1 + 2 * popcount(flips)
+        return diff
@@ -0,0 +1,102 @@
+"""A GameState that keeps evaluation terms up to date as moves are made and taken back, so evaluation functions
+can read them in O(1) instead of scanning the board.
+"""
+from .board import GameState, SQUARE_BITS, popcount
+from .consts import X_PLAYER, O_PLAYER, BOARD_ROWS, BOARD_COLS
+
+CORNERS = [0 * BOARD_ROWS + 0, 0 * BOARD_ROWS + 7, 7 * BOARD_ROWS + 0, 7 * BOARD_ROWS + 7]
+CORNER_MASK = sum(SQUARE_BITS[i] for i in CORNERS)
+
+
+def _corner_neighbours_mask(corner):
+    x, y = divmod(corner, BOARD_ROWS)
+    dx = 1 if x == 0 else -1
+    dy = 1 if y == 0 else -1
+    return sum(SQUARE_BITS[(x + a) * BOARD_ROWS + (y + b)] for a, b in [(dx, 0), (0, dy), (dx, dy)])
+
+# For each corner: (its bit, the mask of its X square and 2 C squares)
+CORNER_NEIGHBOUR_MASKS = [(SQUARE_BITS[corner], _corner_neighbours_mask(corner)) for corner in CORNERS]
+
+
+def make_weight_tables(weights):
+    """Splits a square weights table into 8 lookup tables, one per byte of a bitboard, for weighted_sum.
+
+    :param weights: An 8x8 table of square weights, indexed [x][y].
+    """
+    flat = [weights[x][y] for x in range(BOARD_COLS) for y in range(BOARD_ROWS)]
+    return [[sum(flat[byte * 8 + bit] for bit in range(8) if value & (1 << bit)) for value in range(256)]
+            for byte in range(8)]
+
+
+def weighted_sum(bits, tables):
+    """Returns the sum of the weights of the squares in the bitboard, with 8 table lookups."""
+    return (tables[0][bits & 255] + tables[1][(bits >> 8) & 255] + tables[2][(bits >> 16) & 255] +
+            tables[3][(bits >> 24) & 255] + tables[4][(bits >> 32) & 255] + tables[5][(bits >> 40) & 255] +
+            tables[6][(bits >> 48) & 255] + tables[7][(bits >> 56) & 255])
+
+
+def count_corner_neighbours(own, occupied):
+    """Returns how many of the X and C squares next to the empty corners are in the `own` bitboard."""
+    return sum(popcount(own & neighbours) for corner, neighbours in CORNER_NEIGHBOUR_MASKS if not occupied & corner)
+
+
+class IncrementalGameState(GameState):
+    def __init__(self, weight_tables):
+        """A GameState keeping each color's disc count and sum of square weights up to date, and the number of discs
+        each move made on it flipped (flip_counts, the last move's last).
+
+        :param weight_tables: The square weights, as returned by make_weight_tables.
+        """
+        GameState.__init__(self)
+        self._weight_tables = weight_tables
+        self._recount()
+
+    @classmethod
+    def from_state(cls, state, weight_tables):
+        """Returns an IncrementalGameState of the same position as the given GameState."""
+        new_state = cls.__new__(cls)
+        new_state.discs = dict(state.discs)
+        new_state._curr_player = state.curr_player
+        new_state._key = state.zobrist_key
+        new_state._weight_tables = weight_tables
+        new_state._recount()
+        return new_state
+
+    def _recount(self):
+        self.disc_counts = {color: popcount(discs) for color, discs in self.discs.items()}
+        self.positional_sums = {color: weighted_sum(discs, self._weight_tables) for color, discs in self.discs.items()}
+        self.flip_counts = []
+
+    def make_move(self, xstart, ystart):
+        undo = GameState.make_move(self, xstart, ystart)
+        if undo is not None:
+            square_bit, flips, player, _ = undo
+            opponent = O_PLAYER if player == X_PLAYER else X_PLAYER
+            flipped = popcount(flips)
+            flipped_weight = weighted_sum(flips, self._weight_tables)
+            self.disc_counts[player] += flipped + 1
+            self.disc_counts[opponent] -= flipped
+            self.positional_sums[player] += flipped_weight + weighted_sum(square_bit, self._weight_tables)
+            self.positional_sums[opponent] -= flipped_weight
+            self.flip_counts.append(flipped)
+        return undo
+
+    def unmake_move(self, undo):
+        GameState.unmake_move(self, undo)
+        square_bit, flips, player, _ = undo
+        opponent = O_PLAYER if player == X_PLAYER else X_PLAYER
+        flipped = popcount(flips)
+        flipped_weight = weighted_sum(flips, self._weight_tables)
+        self.disc_counts[player] -= flipped + 1
+        self.disc_counts[opponent] += flipped
+        self.positional_sums[player] -= flipped_weight + weighted_sum(square_bit, self._weight_tables)
+        self.positional_sums[opponent] += flipped_weight
+        self.flip_counts.pop()
+
+    def copy(self):
+        state = GameState.copy(self)
+        state._weight_tables = self._weight_tables
+        state.disc_counts = dict(self.disc_counts)
+        state.positional_sums = dict(self.positional_sums)
+        state.flip_counts = list(self.flip_counts)
+        return state
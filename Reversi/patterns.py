@@ -0,0 +1,206 @@
+"""Pattern evaluation: the board is cut into patterns - each edge with its 2 X squares, the 3x3 and 2x5 corners, and
+the diagonals - and every pattern instance on the board indexes a table of scores, one score for each way its squares
+can be filled. A position's score is the sum of its instances' scores, from the table of its game phase.
+
+The tables are read from a compact binary weights file:
+
+    header (see HEADER), then for each phase, ENTRIES little endian int16 scores in 1/scale discs
+
+Each table holds the tables of all the patterns back to back (see PATTERN_OFFSETS). An instance's index is its
+pattern's offset plus its squares read as a base 3 number: the first square is the lowest digit, and a square is 0 if
+empty, 1 for X and 2 for O. Scores are for X, as a guess of the final disc difference (or of X's log odds of winning,
+for weights fit to the winner - see train.py). Since there are no passes, the number of discs also tells whose turn
+it is, so that doesn't need its own tables.
+"""
+import array
+import collections
+import os
+import struct
+import sys
+from .board import GameState, iter_squares, popcount
+from .book import SYMMETRIES
+from .consts import X_PLAYER, O_PLAYER, BOARD_ROWS, BOARD_COLS
+
+MAGIC = b'RVPW'
+VERSION = 1
+# magic, version, number of phases, scale (scores are in 1/scale discs), entries per phase (so files of another
+# pattern set are refused)
+HEADER = struct.Struct('<4sHHHxxI')
+
+# The defaults of new weights
+PHASES = 6
+SCALE = 32
+
+# Each pattern's squares as (x, y), around the (0, 0) corner. The other instances are its symmetries.
+PATTERNS = collections.OrderedDict([
+    ('edge_2x', [(0, y) for y in range(BOARD_ROWS)] + [(1, 1), (1, 6)]),
+    ('corner_3x3', [(x, y) for x in range(3) for y in range(3)]),
+    ('corner_2x5', [(x, y) for x in range(2) for y in range(5)]),
+    ('diagonal_8', [(i, i) for i in range(8)]),
+    ('diagonal_7', [(i, i + 1) for i in range(7)]),
+    ('diagonal_6', [(i, i + 2) for i in range(6)]),
+    ('diagonal_5', [(i, i + 3) for i in range(5)]),
+    ('diagonal_4', [(i, i + 4) for i in range(4)]),
+])
+
+
+def _instances(squares):
+    """The distinct instances of a pattern on the board, as lists of square indices in the pattern's order."""
+    instances = []
+    seen = set()
+    for symmetry in SYMMETRIES:
+        instance = [symmetry[x * BOARD_ROWS + y] for x, y in squares]
+        if frozenset(instance) not in seen:
+            seen.add(frozenset(instance))
+            instances.append(instance)
+    return instances
+
+
+PATTERN_SIZES = [3 ** len(squares) for squares in PATTERNS.values()]
+PATTERN_OFFSETS = [sum(PATTERN_SIZES[:i]) for i in range(len(PATTERN_SIZES))]
+# Scores per phase
+ENTRIES = sum(PATTERN_SIZES)
+
+# (pattern number, squares) of every pattern instance on the board
+INSTANCES = [(pattern, instance) for pattern, squares in enumerate(PATTERNS.values()) for instance in _instances(squares)]
+# An instance's index with all its squares empty
+EMPTY_INDICES = [PATTERN_OFFSETS[pattern] for pattern, squares in INSTANCES]
+# SQUARE_INSTANCES[square] is a list of (instance number, 3 ** the square's place in the instance)
+SQUARE_INSTANCES = [[] for _ in range(BOARD_ROWS * BOARD_COLS)]
+for _instance, (_pattern, _squares) in enumerate(INSTANCES):
+    for _place, _square in enumerate(_squares):
+        SQUARE_INSTANCES[_square].append((_instance, 3 ** _place))
+
+
+def pattern_indices(discs):
+    """Returns the table index of every pattern instance (in INSTANCES order) for a dict of bitboards."""
+    indices = list(EMPTY_INDICES)
+    for color, digit in ((X_PLAYER, 1), (O_PLAYER, 2)):
+        for square in iter_squares(discs[color]):
+            for instance, power in SQUARE_INSTANCES[square]:
+                indices[instance] += digit * power
+    return indices
+
+
+def get_phase(disc_count, phases):
+    """The game phase of a position with the given number of discs, out of the given number of phases."""
+    return (disc_count - 4) * phases // (BOARD_ROWS * BOARD_COLS - 3)
+
+
+class PatternWeights:
+
+    def __init__(self, tables, scale=SCALE):
+        """Initialize pattern weights.
+
+        :param tables: A sequence of ENTRIES int16 scores per phase, the earliest phase first.
+        :param scale: The scores are in 1/scale discs.
+        :raises ValueError: If a table is not ENTRIES long.
+        """
+        self.tables = [array.array('h', table) for table in tables]
+        if not self.tables or any(len(table) != ENTRIES for table in self.tables):
+            raise ValueError('Pattern tables must have {} entries'.format(ENTRIES))
+        self.phases = len(self.tables)
+        self.scale = scale
+
+    @classmethod
+    def zeros(cls, phases=PHASES, scale=SCALE):
+        return cls([array.array('h', bytes(2 * ENTRIES)) for _ in range(phases)], scale)
+
+    @classmethod
+    def load(cls, path):
+        """Loads weights written by save.
+
+        :raises ValueError: If the file is not a weights file of these patterns.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if len(data) < HEADER.size:
+            raise ValueError('{} is not a pattern weights file'.format(path))
+        magic, version, phases, scale, entries = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION or entries != ENTRIES or \
+                len(data) != HEADER.size + 2 * phases * entries:
+            raise ValueError('{} is not a weights file of these patterns'.format(path))
+
+        scores = array.array('h')
+        scores.frombytes(data[HEADER.size:])
+        if sys.byteorder == 'big':
+            scores.byteswap()
+        return cls([scores[phase * ENTRIES:(phase + 1) * ENTRIES] for phase in range(phases)], scale)
+
+    @classmethod
+    def open(cls, path):
+        """Returns the weights at the given path, or None if there is no weights file there."""
+        if not os.path.exists(path):
+            return None
+        return cls.load(path)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.phases, self.scale, ENTRIES))
+            for table in self.tables:
+                if sys.byteorder == 'big':
+                    table = array.array('h', table)
+                    table.byteswap()
+                f.write(table.tobytes())
+
+    def evaluate_indices(self, indices, disc_count):
+        """Scores the pattern indices (as returned by pattern_indices) of a position with disc_count discs."""
+        table = self.tables[get_phase(disc_count, self.phases)]
+        return sum(map(table.__getitem__, indices)) / float(self.scale)
+
+    def evaluate(self, state):
+        """Returns the score of a state for X, in discs. A PatternGameState's indices are read as they are."""
+        indices = state.pattern_indices if isinstance(state, PatternGameState) else pattern_indices(state.discs)
+        return self.evaluate_indices(indices, state.disc_count)
+
+
+class PatternGameState(GameState):
+    def __init__(self):
+        """A GameState keeping the pattern indices (see pattern_indices) up to date as moves are made and taken back,
+        so a PatternWeights evaluation is just the table lookups. Like IncrementalGameState, it also keeps the number
+        of discs each move made on it flipped (flip_counts).
+        """
+        GameState.__init__(self)
+        self.pattern_indices = pattern_indices(self.discs)
+        self.flip_counts = []
+
+    @classmethod
+    def from_state(cls, state):
+        """Returns a PatternGameState of the same position as the given GameState."""
+        new_state = cls.__new__(cls)
+        new_state.discs = dict(state.discs)
+        new_state._curr_player = state.curr_player
+        new_state._key = state.zobrist_key
+        new_state.pattern_indices = pattern_indices(new_state.discs)
+        new_state.flip_counts = []
+        return new_state
+
+    def _update_indices(self, undo, sign):
+        square_bit, flips, player, _ = undo
+        indices = self.pattern_indices
+        # The placed square goes from empty to the player's digit, a flipped one from the other digit to it
+        placed, flipped = (sign, -sign) if player == X_PLAYER else (2 * sign, sign)
+        for instance, power in SQUARE_INSTANCES[square_bit.bit_length() - 1]:
+            indices[instance] += placed * power
+        for square in iter_squares(flips):
+            for instance, power in SQUARE_INSTANCES[square]:
+                indices[instance] += flipped * power
+
+    def make_move(self, xstart, ystart):
+        undo = GameState.make_move(self, xstart, ystart)
+        if undo is not None:
+            self._update_indices(undo, 1)
+            self.flip_counts.append(popcount(undo[1]))
+        return undo
+
+    def unmake_move(self, undo):
+        GameState.unmake_move(self, undo)
+        self._update_indices(undo, -1)
+        self.flip_counts.pop()
+
+    def copy(self):
+        state = GameState.copy(self)
+        state.pattern_indices = list(self.pattern_indices)
+        state.flip_counts = list(self.flip_counts)
+        return state
@@ -0,0 +1,79 @@
+"""Perft: counts the positions reachable from a state in a given number of moves, to check and time the move
+generation (get_possible_moves) and make/unmake against known counts.
+
+In this game a player that has no moves ends the game (there are no passes), so a finished game counts as a single
+leaf, whatever depth it ended at.
+
+    python -m Reversi.perft [--divide] depth [-- board string]
+
+(Board strings often start with '-', hence the '--'.)
+
+--divide splits the count by the first move, to find which subtree a wrong count comes from.
+"""
+from __future__ import print_function
+import argparse
+import sys
+import time
+from .board import GameState
+
+
+def perft(state, depth):
+    """Counts the leaves of the game tree under the given state, to the given depth.
+
+    :param state: The GameState to count from. Moves are made and taken back in place, so it ends up unchanged.
+    :param depth: The number of moves to look ahead.
+    :return: The number of leaves.
+    """
+    if depth == 0:
+        return 1
+
+    moves = state.get_possible_moves()
+    if not moves:
+        return 1
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        undo = state.make_move(move[0], move[1])
+        nodes += perft(state, depth - 1)
+        state.unmake_move(undo)
+    return nodes
+
+
+def perft_divide(state, depth):
+    """Splits perft(state, depth) by the first move.
+
+    :return: A list of ([x, y], leaves under that move) tuples, in move order.
+    """
+    counts = []
+    for move in state.get_possible_moves():
+        undo = state.make_move(move[0], move[1])
+        counts.append((move, perft(state, depth - 1)))
+        state.unmake_move(undo)
+    return counts
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Counts the leaves of the move tree to the given depth.')
+    parser.add_argument('depth', type=int)
+    parser.add_argument('board', nargs='?', help='a board string (see GameState.from_string), default: the start')
+    parser.add_argument('--divide', action='store_true', help='split the count by the first move')
+    args = parser.parse_args(argv)
+
+    state = GameState.from_string(args.board) if args.board else GameState()
+    start = time.time()
+    if args.divide and args.depth > 0:
+        counts = perft_divide(state, args.depth)
+        for move, nodes in counts:
+            print('{},{} {}'.format(move[0], move[1], nodes))
+        nodes = sum(nodes for move, nodes in counts) or 1
+    else:
+        nodes = perft(state, args.depth)
+    seconds = time.time() - start
+    print('perft({}) = {}  ({:.3f}s, {:.0f} leaves/s)'.format(args.depth, nodes, seconds,
+                                                             nodes / seconds if seconds > 0 else 0.0))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+"""Stable discs: discs that can't be flipped for the rest of the game, whatever is played.
+
+A disc can only be flipped along one of the 4 axes through it (horizontal, vertical and the 2 diagonals), by being
+bracketed between an opponent's disc on one side and a new disc placed on an empty square on the other. So a disc
+is stable if along every axis either
+    - it's on the border, with no square on one side,
+    - the whole line along the axis is full, so no disc can be placed on it, or
+    - it's next to a stable disc of its own color, which will never bracket it.
+Starting from the corners, which are stable along every axis, stability spreads along the edges and inwards.
+This finds most, but not all, of the stable discs - so their count is a lower bound.
+"""
+from .board import SQUARE_BITS, FULL_MASK, popcount
+from .consts import BOARD_ROWS, BOARD_COLS
+
+_BYTE_LOWS = 0x0101010101010101
+
+_X_BORDER = 0xFF | (0xFF << (BOARD_ROWS * (BOARD_COLS - 1)))
+_Y_BORDER = sum(SQUARE_BITS[x * BOARD_ROWS] | SQUARE_BITS[x * BOARD_ROWS + BOARD_ROWS - 1] for x in range(BOARD_COLS))
+BORDER_MASK = _X_BORDER | _Y_BORDER
+
+# The diagonals (x - y fixed) and anti-diagonals (x + y fixed) of 3 squares or more. Shorter ones are all border.
+DIAGONAL_LINES = [sum(SQUARE_BITS[x * BOARD_ROWS + x - d] for x in range(BOARD_COLS) if 0 <= x - d < BOARD_ROWS)
+                  for d in range(-(BOARD_ROWS - 3), BOARD_COLS - 2)]
+ANTI_DIAGONAL_LINES = [sum(SQUARE_BITS[x * BOARD_ROWS + s - x] for x in range(BOARD_COLS) if 0 <= s - x < BOARD_ROWS)
+                       for s in range(2, BOARD_ROWS + BOARD_COLS - 3)]
+
+# Masks keeping shifted bitboards from wrapping around between y == 7 and y == 0 of the next column
+_NOT_Y0 = FULL_MASK & ~sum(SQUARE_BITS[x * BOARD_ROWS] for x in range(BOARD_COLS))
+_NOT_Y7 = FULL_MASK & ~sum(SQUARE_BITS[x * BOARD_ROWS + BOARD_ROWS - 1] for x in range(BOARD_COLS))
+
+
+def _full_lines(lines, occupied):
+    full = 0
+    for line in lines:
+        if occupied & line == line:
+            full |= line
+    return full
+
+
+def get_full_lines(occupied):
+    """Returns, for each axis, a bitboard of the squares whose whole line along it is occupied.
+
+    :return: A tuple of 4 bitboards: (x axis, y axis, diagonal, anti-diagonal).
+    """
+    # Along y (x fixed) a line is a byte of the bitboard: and its bits together into bit 0
+    t = occupied & (occupied >> 4)
+    t &= t >> 2
+    t &= t >> 1
+    y_full = (t & _BYTE_LOWS) * 0xFF
+    # Along x (y fixed) a line is the same bit of every byte: and the bytes together into the lowest one
+    t = occupied & (occupied >> 32)
+    t &= t >> 16
+    t &= t >> 8
+    x_full = (t & 0xFF) * _BYTE_LOWS
+    return x_full, y_full, _full_lines(DIAGONAL_LINES, occupied), _full_lines(ANTI_DIAGONAL_LINES, occupied)
+
+
+def get_stable_discs(own, opp, full_lines=None):
+    """Returns a bitboard of the stable discs of the player owning `own` (a subset of the truly stable ones).
+
+    :param full_lines: get_full_lines of the position, if it was already computed for the other player.
+    """
+    x_full, y_full, diagonal_full, anti_diagonal_full = full_lines or get_full_lines(own | opp)
+    # Along each axis: the discs that are safe without looking at their neighbours
+    x_safe = own & (x_full | _X_BORDER)
+    y_safe = own & (y_full | _Y_BORDER)
+    diagonal_safe = own & (diagonal_full | BORDER_MASK)
+    anti_diagonal_safe = own & (anti_diagonal_full | BORDER_MASK)
+
+    stable = 0
+    while True:
+        new_stable = (
+            (x_safe | (stable << 8) | (stable >> 8)) &
+            (y_safe | ((stable << 1) & _NOT_Y0) | ((stable >> 1) & _NOT_Y7)) &
+            (diagonal_safe | ((stable << 9) & _NOT_Y0) | ((stable >> 9) & _NOT_Y7)) &
+            (anti_diagonal_safe | ((stable << 7) & _NOT_Y7) | ((stable >> 7) & _NOT_Y0))) & own
+        if new_stable == stable:
+            return stable
+        stable = new_stable
+
+
+def count_stable_discs(own, opp):
+    """Returns the number of stable discs of each player, as a tuple: (own, opp)."""
+    full_lines = get_full_lines(own | opp)
+    return popcount(get_stable_discs(own, opp, full_lines)), popcount(get_stable_discs(opp, own, full_lines))
@@ -18,6 +18,10 @@ Like this: 'class Player(abstract.AbstractPlayer):'
         self.color = player_type
         self.time_per_k_turns = time_per_k_turns
         self.k = k
+        # A utils.Deadline set by the game runner before each move. The player must return before it expires.
+        self.deadline = None
+        # Whether the player should keep stats of its searches, for get_search_stats. Set by enable_stats.
+        self.collect_stats = False
 
     def get_move(self, game_state, possible_moves):
         """Chooses an action from the given actions.
@@ -28,6 +32,31 @@ Like this: 'class Player(abstract.AbstractPlayer):'
         """
         raise NotImplementedError
 
+    def start_pondering(self, game_state):
+        """Called after the player's move was played, when it runs in its own process. The player may keep
+        thinking on the opponent's time until stop_pondering is called. This is not counted as its time, but it must
+        return right away.
+
+        :param game_state: The board state after the player's move, the opponent to move.
+        """
+        pass
+
+    def stop_pondering(self, game_state):
+        """Called before the player's next get_move, when it runs in its own process. The player must stop any
+        thinking started by start_pondering, and return right away.
+
+        :param game_state: The board state the player is about to move from.
+        """
+        pass
+
+    def enable_stats(self):
+        """Asks the player to keep stats of its searches from now on. Called by the game runner when it logs them."""
+        self.collect_stats = True
+
+    def get_search_stats(self):
+        """Returns stats of the search behind the last move, as a JSON friendly dict, or None if there are none."""
+        return None
+
     def __repr__(self):
         return self.color
 
@@ -0,0 +1,205 @@
+"""
+A reproducible benchmark suite. On a fixed set of opening, midgame and endgame positions it runs perft (checked
+against known counts), fixed-depth searches of every search algorithm and fixed-time moves of every search player,
+and writes the node counts, times and NPS as JSON, so the numbers can be compared between commits.
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+from functools import partial
+from utils import (MiniMaxAlgorithm, MiniMaxWithAlphaBetaPruning, PrincipalVariationSearch, TranspositionTable,
+                   MoveOrdering, SearchStats, Deadline)
+from Reversi.board import GameState
+from Reversi.perft import perft
+from players.better_player import Player as BetterPlayer, POSITIONS as SQUARE_WEIGHTS
+
+# A benchmark position: its name, board string (see GameState.from_string), and perft counts by depth
+Position = collections.namedtuple('Position', ['name', 'board', 'perft'])
+
+POSITIONS = [
+    Position('start', '---------------------------XO------OX---------------------------X',
+             {6: 8200, 7: 55092}),
+    Position('opening_1', '-----------X--------X------XOX-----OOO----O------O--------------X',
+             {4: 727}),
+    Position('opening_2', '----------X---O---OOOOOO---XX-----XXXX--------------------------X',
+             {4: 3168}),
+    Position('midgame_1', '-----------X-O---XXX-OXX---OXO--XXXXXOO----O-OOO---OOO-O---O-O--X',
+             {4: 6628}),
+    Position('midgame_2', '-----OXO--O-XXOO--OOOOXO-XXOOXXX--XOXOXO--XOOX----XO--X---------X',
+             {4: 22207}),
+    Position('endgame_1', '--OOOOO-OO-OXOXXXXOXOXOXXXOOXXOX--XXOXOXOOXXOOO-OO-OOOO---O-O-X-X',
+             {4: 2072}),
+    Position('endgame_2', 'OOOOOOOO-XO-OOOXOOXXOOXXOOXXOXXXOOOOOXXX-OO-OOXXOO-OOO-X-OO-OO--X',
+             {4: 840}),
+]
+
+# Transposition table size of the searches, in bytes
+TRANSPOSITION_TABLE_MEMORY = 32 * 1024 * 1024
+
+ALGORITHMS = collections.OrderedDict([
+    ('minimax', lambda: MiniMaxAlgorithm),
+    ('alpha_beta', lambda: partial(MiniMaxWithAlphaBetaPruning,
+                                   transposition_table=TranspositionTable(TRANSPOSITION_TABLE_MEMORY),
+                                   move_ordering=MoveOrdering(static_weights=SQUARE_WEIGHTS))),
+    ('pvs', lambda: partial(PrincipalVariationSearch,
+                            transposition_table=TranspositionTable(TRANSPOSITION_TABLE_MEMORY),
+                            move_ordering=MoveOrdering(static_weights=SQUARE_WEIGHTS))),
+])
+# Plain minimax can't go as deep in reasonable time
+SEARCH_DEPTHS = {'minimax': 3, 'alpha_beta': 5, 'pvs': 5}
+
+PLAYERS = ['min_max_player', 'alpha_beta_player', 'pvs_player']
+
+
+def _nps(nodes, seconds):
+    return nodes / seconds if seconds > 0 else 0.0
+
+
+def bench_perft(position, depth):
+    """Counts perft(depth) of the position, checked against its known count if there is one."""
+    state = GameState.from_string(position.board)
+    start = time.perf_counter()
+    nodes = perft(state, depth)
+    seconds = time.perf_counter() - start
+    expected = position.perft.get(depth)
+    return {'suite': 'perft', 'name': 'perft', 'position': position.name, 'depth': depth, 'nodes': nodes,
+            'expected': expected, 'ok': expected is None or nodes == expected, 'time': seconds,
+            'nps': _nps(nodes, seconds)}
+
+
+def bench_search(algorithm, position, depth):
+    """Searches the position with iterative deepening up to the given depth, as the players do, with a fresh
+    transposition table and move ordering. The evaluation is better_player's.
+    """
+    state = GameState.from_string(position.board)
+    color = state.curr_player
+    player = BetterPlayer(0, color, 1, 1)
+    stats = SearchStats()
+    alg = ALGORITHMS[algorithm]()(player.utility, color, lambda: False, None, stats=stats)
+
+    state = player.search_state(state)
+    start = time.perf_counter()
+    for d in range(1, depth + 1):
+        value, move = alg.search(state, d)
+    seconds = time.perf_counter() - start
+    stats.stop()
+    stats.depth = depth
+
+    result = {'suite': 'search', 'name': algorithm, 'position': position.name, 'depth': depth, 'value': value,
+              'move': move, 'time': seconds, 'nps': _nps(stats.nodes, seconds)}
+    result.update((key, stat) for key, stat in stats.as_dict().items() if key not in result)
+    return result
+
+
+def bench_player(player_name, position, time_limit):
+    """Asks a fresh player for its move in the position, with time_limit seconds for the move."""
+    state = GameState.from_string(position.board)
+    __import__('players.' + player_name)
+    player = sys.modules['players.' + player_name].Player(2, state.curr_player, time_limit, 1)
+    player.enable_stats()
+    try:
+        player.deadline = Deadline(time_limit)
+        start = time.perf_counter()
+        move = player.get_move(state.copy(), state.get_possible_moves())
+        seconds = time.perf_counter() - start
+    finally:
+        if getattr(player, 'search_pool', None) is not None:
+            player.search_pool.close()
+
+    stats = player.get_search_stats() or {}
+    nodes = stats.get('nodes', 0)
+    return {'suite': 'player', 'name': player_name, 'position': position.name, 'time_limit': time_limit,
+            'move': move, 'depth': stats.get('depth'), 'nodes': nodes, 'time': seconds, 'nps': _nps(nodes, seconds)}
+
+
+def environment():
+    """Where the numbers come from."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run_benchmarks(suites, positions, depth=None, perft_depth=None, time_limit=1.0):
+    """Runs the chosen suites over the positions.
+
+    :param suites: Any of 'perft', 'search' and 'player'.
+    :param depth: The search depth of every algorithm, or None for SEARCH_DEPTHS.
+    :param perft_depth: The perft depth, or None for the deepest known count of each position.
+    :param time_limit: Seconds per move of the players.
+    :return: A list of result dicts.
+    """
+    results = []
+    for position in positions:
+        if 'perft' in suites:
+            results.append(bench_perft(position, perft_depth or max(position.perft)))
+        if 'search' in suites:
+            for algorithm in ALGORITHMS:
+                results.append(bench_search(algorithm, position, depth or SEARCH_DEPTHS[algorithm]))
+        if 'player' in suites:
+            for player_name in PLAYERS:
+                results.append(bench_player(player_name, position, time_limit))
+    return results
+
+
+def _result_key(result):
+    return result['suite'], result['name'], result['position']
+
+
+def compare(old_results, results):
+    """Prints each result's time and nodes next to the same benchmark's in an older run."""
+    old = {_result_key(result): result for result in old_results}
+    for result in results:
+        before = old.get(_result_key(result))
+        if before is None:
+            continue
+        print('{:<7} {:<18} {:<10} time {:8.3f}s -> {:8.3f}s ({:+6.1f}%)  nodes {:>9} -> {:>9}'.format(
+            result['suite'], result['name'], result['position'], before['time'], result['time'],
+            100.0 * (result['time'] - before['time']) / before['time'] if before['time'] else 0.0,
+            before['nodes'], result['nodes']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--suites', default='perft,search,player', help='comma separated: perft, search, player')
+    parser.add_argument('--positions', help='comma separated position names (default: all)')
+    parser.add_argument('--depth', type=int, help='search depth for every algorithm (default: per algorithm)')
+    parser.add_argument('--perft-depth', type=int, help='perft depth (default: the deepest known count)')
+    parser.add_argument('--time', type=float, default=1.0, help='seconds per move in the player suite')
+    parser.add_argument('--json', help='write the results as JSON to this path')
+    parser.add_argument('--compare', help='a JSON file of an earlier run to compare the results with')
+    args = parser.parse_args(argv)
+
+    suites = args.suites.split(',')
+    positions = POSITIONS
+    if args.positions:
+        names = args.positions.split(',')
+        positions = [position for position in POSITIONS if position.name in names]
+
+    results = run_benchmarks(suites, positions, args.depth, args.perft_depth, args.time)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+    for result in results:
+        print('{:<7} {:<18} {:<10} depth {:>2}  nodes {:>9}  time {:8.3f}s  nps {:>9.0f}{}'.format(
+            result['suite'], result['name'], result['position'], result['depth'] or 0, result['nodes'],
+            result['time'], result['nps'], '' if result.get('ok', True) else '  PERFT MISMATCH'))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)['results'], results)
+
+    if not all(result.get('ok', True) for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,10 +1,12 @@
 import abstract        
 from utils import MiniMaxWithAlphaBetaPruning
-from players.min_max_player import Player as MinMaxPlayer
+from players.min_max_player import TableSearchPlayer
 
-class Player(MinMaxPlayer):
-    def __init__(self, setup_time, player_color, time_per_k_turns, k, alg = None):
-        MinMaxPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k, MiniMaxWithAlphaBetaPruning)
+class Player(TableSearchPlayer):
+    def __init__(self, setup_time, player_color, time_per_k_turns, k, alg = None, search_workers = None,
+                 endgame_empties = None):
+        TableSearchPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k, MiniMaxWithAlphaBetaPruning,
+                                   endgame_empties=endgame_empties, search_workers=search_workers)
 
     def __repr__(self):
         return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'alpha_beta')
@@ -3,12 +3,17 @@
 # ===============================================================================
 
 import abstract
-from utils import INFINITY, run_with_limited_time, ExceededTimeError, _expand_state,ExtractMostPopularOpenningMoves
-from Reversi.consts import EM, OPPONENT_COLOR, BOARD_COLS, BOARD_ROWS, TIE
-import time
-import copy
+from utils import INFINITY, run_with_limited_time, ExceededTimeError, TimeManager
+from Reversi.consts import OPPONENT_COLOR, TIE, X_PLAYER, O_PLAYER
+import random
 import numpy as np
-from Reversi.board import GameState
+from Reversi.board import popcount, get_moves_mask
+from Reversi.book import OpeningBook
+from Reversi.patterns import PatternWeights, PatternGameState
+from Reversi.stability import count_stable_discs
+from Reversi.incremental import (IncrementalGameState, CORNER_MASK, make_weight_tables, weighted_sum,
+                                 count_corner_neighbours)
+from players.better_player.batch import BatchEvaluator, pack_children
 
 # ===============================================================================
 # Player
@@ -25,8 +30,27 @@ POSITIONS = [
     [4, -3, 2, 2, 2, 2, -3, 4]
 ]
 
+# The opening book compiled from book.gam (python -m Reversi.book book.gam book.bin)
+BOOK_PATH = 'book.bin'
+# The pattern evaluation weights (see Reversi.patterns). Without them, the hand-tuned evaluation below is used.
+WEIGHTS_PATH = 'patterns.bin'
+
 TOTAL_POSITION_SCORE = float(sum(sum(abs(v) for v in row) for row in POSITIONS))
 MAX_POSITION_SCORE = float(max(max(v for v in row) for row in POSITIONS))
+POSITION_TABLES = make_weight_tables(POSITIONS)
+# What a stable disc adds to the stability term: as much as a corner
+STABLE_DISC_WEIGHT = MAX_POSITION_SCORE
+
+# A move flipping this many discs leaves the position unsettled enough to search it deeper
+VOLATILE_FLIPS = 6
+# ProbCut margins (see utils.ProbCut) of the two evaluations: about 1.5 standard deviations of the difference between
+# the values of a search and of one 2 plies shallower, measured on random midgame positions
+HAND_TUNED_PROBCUT_MARGIN = 2500.0
+PATTERN_PROBCUT_MARGIN = 5.0
+# PVS aspiration window half widths of the two evaluations, a little under the usual change of the root score between
+# iterations
+HAND_TUNED_ASPIRATION_WINDOW = 1000.0
+PATTERN_ASPIRATION_WINDOW = 2.0
 
 X = [-1, -1, 0, 1, 1, 1, 0, -1]
 Y = [0, 1, 1, 1, 0, -1, -1, -1]
@@ -34,54 +58,94 @@ Y = [0, 1, 1, 1, 0, -1, -1, -1]
 class Player(abstract.AbstractPlayer):
     def __init__(self, setup_time, player_color, time_per_k_turns, k):
         abstract.AbstractPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k)
-        self.clock = time.time()
-
-        # We are simply providing (remaining time / remaining turns) for each turn in round.
-        # Taking a spare time of 0.05 seconds.
-        self.turns_remaining_in_round = self.k
-        self.time_remaining_in_round = self.time_per_k_turns
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
-        self._last_game_state = ''
-        self._last_game_board = GameState().board
-        self.opening_dict = ExtractMostPopularOpenningMoves(70)
-        self.opponent_sign = '-' if self.color == 'X' else '+'
+        # Book moves and forced moves take next to no time, and what they save is banked for the rest of the round.
+        self.time_manager = TimeManager(self.time_per_k_turns, self.k)
+        self.opening_book = OpeningBook.open(BOOK_PATH)
+        self.batch_evaluator = BatchEvaluator(self.color, POSITIONS, STABLE_DISC_WEIGHT)
+        self.pattern_weights = PatternWeights.open(WEIGHTS_PATH)
+        self.probcut_margin = HAND_TUNED_PROBCUT_MARGIN if self.pattern_weights is None else PATTERN_PROBCUT_MARGIN
+        self.aspiration_window = (HAND_TUNED_ASPIRATION_WINDOW if self.pattern_weights is None
+                                  else PATTERN_ASPIRATION_WINDOW)
 
     def get_move(self, game_state, possible_moves):
-        self.clock = time.time()
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        self.time_manager.start_move(self.deadline)
+        try:
+            return self._get_move(game_state, possible_moves)
+        finally:
+            self.time_manager.end_move()
 
-        open_move = None if self._last_game_state == None else self._opening_move(game_state.board)
+    def _get_move(self, game_state, possible_moves):
+        # The book is keyed by position, so we can get back into it after a move order it doesn't have.
+        open_move = None if self.opening_book is None else self._opening_move(game_state, possible_moves)
 
         if  open_move!= None:
             return open_move
-        else:
-            self._last_game_state = None
 
         if len(possible_moves) == 1:
             return possible_moves[0]
 
-        best_move = possible_moves[0]
-        next_state = copy.deepcopy(game_state)
-        next_state.perform_move(best_move[0], best_move[1])
-        # Choosing an arbitrary move
-        # Get the best move according the utility function
-        for move in possible_moves:
-            new_state = copy.deepcopy(game_state)
-            new_state.perform_move(move[0], move[1])
-            if self.utility(new_state) > self.utility(next_state):
-                next_state = new_state
-                best_move = move
-
-        if self.turns_remaining_in_round == 1:
-            self.turns_remaining_in_round = self.k
-            self.time_remaining_in_round = self.time_per_k_turns
-        else:
-            self.turns_remaining_in_round -= 1
-            self.time_remaining_in_round -= (time.time() - self.clock)
+        # Get the best move according the utility function.
+        # The first of the best moves is chosen, as argmax returns the first maximum.
+        best_move = possible_moves[int(np.argmax(self.evaluate_moves(game_state, possible_moves)))]
 
         return best_move
 
+    def evaluate_moves(self, game_state, moves):
+        """Returns a NumPy array of the utilities of the states the moves lead to. The state itself is unchanged."""
+        if self.pattern_weights is None:
+            # Evaluating all the moves at once
+            return self.batch_evaluator.evaluate(*pack_children(game_state, moves))
+
+        values = []
+        for move in moves:
+            undo = game_state.make_move(move[0], move[1])
+            values.append(self.utility(game_state))
+            game_state.unmake_move(undo)
+        return np.array(values, dtype=np.float64)
+
+    def search_state(self, game_state):
+        """Returns a copy of the state to search in place, keeping the evaluation's terms up to date as moves are
+        made.
+        """
+        if self.pattern_weights is not None:
+            return PatternGameState.from_state(game_state)
+        return IncrementalGameState.from_state(game_state, POSITION_TABLES)
+
     def utility(self, state, is_expanded=False):
+        if self.pattern_weights is not None:
+            return self._pattern_utility(state)
+
+        # Forced moves are made in place on the given state, and taken back before returning.
+        undo_moves = []
+        try:
+            return self._utility(state, undo_moves)
+        finally:
+            while undo_moves:
+                state.unmake_move(undo_moves.pop())
+
+    def utility_batch(self, states):
+        """Evaluates many states at once, vectorized. Gives the same values as utility.
+
+        :param states: A list of GameStates.
+        :return: A NumPy array of the utilities.
+        """
+        if self.pattern_weights is not None:
+            return np.array([self._pattern_utility(state) for state in states], dtype=np.float64)
+        return self.batch_evaluator.evaluate_states(states)
+
+    def _pattern_utility(self, state):
+        discs = state.discs
+        if not get_moves_mask(discs[state.curr_player], discs[OPPONENT_COLOR[state.curr_player]]):
+            # The game is over
+            my_units = popcount(discs[self.color])
+            op_units = popcount(discs[OPPONENT_COLOR[self.color]])
+            return 0 if my_units == op_units else (-INFINITY if my_units < op_units else +INFINITY)
+
+        # The weights score for X
+        score = self.pattern_weights.evaluate(state)
+        return score if self.color == X_PLAYER else -score
+
+    def _utility(self, state, undo_moves):
         op_color = OPPONENT_COLOR[self.color]
 
         # Exhaust no-brainer states
@@ -90,15 +154,16 @@ class Player(abstract.AbstractPlayer):
             ran_once = True
             moves = state.get_possible_moves()
 
-            reverse_state = copy.deepcopy(state)
-            reverse_state.curr_player = op_color
-            reverse_moves = reverse_state.get_possible_moves()
+            curr_player = state.curr_player
+            state.curr_player = op_color
+            reverse_moves = state.get_possible_moves()
+            state.curr_player = curr_player
 
             my_moves = len(moves)
             op_moves = len(reverse_moves)
 
-            my_units = sum(sum(c == self.color for c in row) for row in state.board)
-            op_units = sum(sum(c == op_color for c in row) for row in state.board)
+            my_units = self._get_units(state, self.color)
+            op_units = self._get_units(state, op_color)
 
             if my_units == 0:
                 return -INFINITY
@@ -111,8 +176,7 @@ class Player(abstract.AbstractPlayer):
                 break
 
             # Go to next state
-            state = copy.deepcopy(state)
-            state.perform_move(moves[0][0], moves[0][1])
+            undo_moves.append(state.make_move(moves[0][0], moves[0][1]))
 
         player_mod = -1 if state.curr_player != self.color else +1
 
@@ -124,9 +188,10 @@ class Player(abstract.AbstractPlayer):
         # Mobility
         m = 0 if my_moves + op_moves == 0 else 100*(my_moves - op_moves)/float(my_moves + op_moves)
 
-        # Stability
-        my_stab = self._get_stability_value(state, self.color)
-        op_stab =self._get_stability_value(state, op_color)
+        # Stability: the discs that are stable, and the square weights as a guess of which will become stable
+        my_stable, op_stable = count_stable_discs(state.discs[self.color], state.discs[op_color])
+        my_stab = self._get_positional_value(state, self.color) + STABLE_DISC_WEIGHT * my_stable
+        op_stab = self._get_positional_value(state, op_color) + STABLE_DISC_WEIGHT * op_stable
         s = 0 if (my_stab + op_stab) == 0 else 50*(my_stab - op_stab)/float(my_stab + op_stab)
 
         # Corner Occupancy
@@ -154,64 +219,54 @@ class Player(abstract.AbstractPlayer):
 
         return player_mod * h
 
-    def _get_stability_value(self, state, target_color):
-        return sum(sum(POSITIONS[r][c] if color == target_color else 0 for c, color in enumerate(row)) for r, row in
-                   enumerate(state.board))
-
-    def _get_corner_occupancy(self, state, color):
-        board = state.board
-
-        return float((board[0][0] == color) +
-                     (board[BOARD_ROWS - 1][0] == color) +
-                     (board[0][BOARD_COLS - 1] == color) +
-                     (board[BOARD_ROWS - 1][BOARD_COLS - 1] == color))
-
-    def _get_corner_close(self, state, color):
-        board = state.board
+    # The terms below are read from an IncrementalGameState in O(1), or computed from the bitboards otherwise.
 
-        return (self._get_specific_corner_control_score(board, color, 0, 0) +
-                self._get_specific_corner_control_score(board, color, BOARD_ROWS - 1, 0) +
-                self._get_specific_corner_control_score(board, color, 0, BOARD_COLS - 1) +
-                self._get_specific_corner_control_score(board, color, BOARD_ROWS - 1, BOARD_COLS - 1))
+    def _get_units(self, state, color):
+        if isinstance(state, IncrementalGameState):
+            return state.disc_counts[color]
+        return popcount(state.discs[color])
 
-    def _get_specific_corner_control_score(self, board, color, x, y):
-        if not board[x][y] == EM:
-            return 0
+    def _get_positional_value(self, state, target_color):
+        if isinstance(state, IncrementalGameState):
+            return state.positional_sums[target_color]
+        return weighted_sum(state.discs[target_color], POSITION_TABLES)
 
-        dx = +1 if x == 0 else -1
-        dy = +1 if y == 0 else -1
+    def _get_corner_occupancy(self, state, color):
+        return float(popcount(state.discs[color] & CORNER_MASK))
 
-        return sum(c == color for c in [board[x + dx][y], board[x][y + dy], board[x + dx][y + dy]])
+    def _get_corner_close(self, state, color):
+        # Own discs next to the empty corners
+        discs = state.discs
+        return count_corner_neighbours(discs[color], discs[X_PLAYER] | discs[O_PLAYER])
 
     def selective_deepening_criterion(self, state):
-        # Better player does not selectively deepen into certain nodes.
-        return False
+        # Unsettled positions are searched deeper: the last move flipped many discs (the search states count them),
+        # the player to move can take a corner, or has a single move.
+        flip_counts = getattr(state, 'flip_counts', None)
+        if flip_counts and flip_counts[-1] >= VOLATILE_FLIPS:
+            return True
+
+        discs = state.discs
+        moves = get_moves_mask(discs[state.curr_player], discs[OPPONENT_COLOR[state.curr_player]])
+        return bool(moves & CORNER_MASK) or (moves != 0 and not moves & (moves - 1))
 
     def no_more_time(self):
-        return (time.time() - self.clock) >= self.time_for_current_move
+        return self.time_manager.no_more_time()
 
     def __repr__(self):
         return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'better')
 
-    def _opening_move(self, board):
-        self._updateNewOpponentMove(board)
-
-        nextMove = self.opening_dict.get(self._last_game_state)
-        if nextMove == None: return None
-
-        self._last_game_state += nextMove
-        coord = [ord(nextMove[1]) -97, int(nextMove[2]) - 1]
-        self._last_game_board[coord[0]][coord[1]] = self.color
-        return coord
-
-    def _updateNewOpponentMove(self, board):
-
-        for x in range(8):
-            for y in range(8):
-                    if self._last_game_board[x][y] == ' ' and board[x][y] != ' ':
-                        self._last_game_state += self.opponent_sign + chr(x + 97) + str(y + 1)
-                        self._last_game_board = board
-                        return True;
+    def _opening_move(self, state, possible_moves):
+        # A book move from this position, chosen at random weighted by how many games played it
+        book_moves = [(move, games) for move, games in self.opening_book.lookup(state) if move in possible_moves]
+        if not book_moves:
+            return None
+
+        choice = random.randrange(sum(games for move, games in book_moves))
+        for move, games in book_moves:
+            choice -= games
+            if choice < 0:
+                return move
 
 # c:\python35\python.exe run_game.py 3 3 3 y better_player random_player
 
@@ -0,0 +1,247 @@
+"""A NumPy-vectorized version of the better player's utility, evaluating many positions in one call.
+
+Positions are packed as uint64 bitboard arrays (square (x, y) is bit x * 8 + y, as in Reversi.board).
+"""
+import numpy as np
+from utils import INFINITY
+from Reversi.board import DIRECTIONS, FULL_MASK
+from Reversi.stability import DIAGONAL_LINES, ANTI_DIAGONAL_LINES, BORDER_MASK
+from Reversi.consts import X_PLAYER, O_PLAYER, BOARD_ROWS, BOARD_COLS
+
+_DIRECTIONS = [(np.uint64(abs(shift)), shift > 0, np.uint64(mask)) for shift, mask in DIRECTIONS]
+_FULL = np.uint64(FULL_MASK)
+_ZERO = np.uint64(0)
+_ONE = np.uint64(1)
+_BYTE_LOWS = np.uint64(0x0101010101010101)
+_BYTE = np.uint64(0xFF)
+_X_BORDER = np.uint64(0xFF | (0xFF << 56))
+_Y_BORDER = np.uint64(0x8181818181818181)
+_BORDER = np.uint64(BORDER_MASK)
+_NOT_Y0 = np.uint64(FULL_MASK & ~0x0101010101010101)
+_NOT_Y7 = np.uint64(FULL_MASK & ~0x8080808080808080)
+_DIAGONAL_LINES = [np.uint64(line) for line in DIAGONAL_LINES]
+_ANTI_DIAGONAL_LINES = [np.uint64(line) for line in ANTI_DIAGONAL_LINES]
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+# (corner, its 3 neighbours) as square indices
+_CORNERS = [0, 7, 56, 63]
+_CORNER_NEIGHBOURS = [[8, 1, 9], [15, 6, 14], [48, 57, 49], [55, 62, 54]]
+
+# Feature weights (p, c, l, m, s) by number of discs on the board, as in Player.utility
+_WEIGHT_BANDS = [(16, (0, 15, 5, 30, 50)), (32, (5, 15, 10, 20, 40)), (48, (15, 40, 15, 10, 20)),
+                 (BOARD_ROWS * BOARD_COLS + 1, (40, 30, 5, 5, 20))]
+
+
+def popcount(bits):
+    """Vectorized popcount of a uint64 array."""
+    bits = np.ascontiguousarray(bits, dtype=np.uint64)
+    return _POPCOUNT8[bits.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _shift(bits, shift, left, mask):
+    return ((bits << shift) if left else (bits >> shift)) & mask
+
+
+def get_moves_masks(own, opp):
+    """Vectorized Reversi.board.get_moves_mask."""
+    empty = ~(own | opp) & _FULL
+    moves = np.zeros_like(own)
+    for shift, left, mask in _DIRECTIONS:
+        t = _shift(own, shift, left, mask) & opp
+        for _ in range(5):
+            t |= _shift(t, shift, left, mask) & opp
+        moves |= _shift(t, shift, left, mask) & empty
+    return moves
+
+
+def get_flips_masks(own, opp, move):
+    """The discs flipped by placing one disc per position, given as a single bit bitboard."""
+    flips = np.zeros_like(own)
+    for shift, left, mask in _DIRECTIONS:
+        t = _shift(move, shift, left, mask) & opp
+        for _ in range(5):
+            t |= _shift(t, shift, left, mask) & opp
+        bounded = (_shift(t, shift, left, mask) & own) != _ZERO
+        flips |= np.where(bounded, t, _ZERO)
+    return flips
+
+
+def _full_lines(lines, occupied):
+    full = np.zeros_like(occupied)
+    for line in lines:
+        full |= np.where(occupied & line == line, line, _ZERO)
+    return full
+
+
+def get_full_lines(occupied):
+    """Vectorized Reversi.stability.get_full_lines."""
+    t = occupied & (occupied >> np.uint64(4))
+    t &= t >> np.uint64(2)
+    t &= t >> _ONE
+    y_full = (t & _BYTE_LOWS) * _BYTE
+    t = occupied & (occupied >> np.uint64(32))
+    t &= t >> np.uint64(16)
+    t &= t >> np.uint64(8)
+    x_full = (t & _BYTE) * _BYTE_LOWS
+    return x_full, y_full, _full_lines(_DIAGONAL_LINES, occupied), _full_lines(_ANTI_DIAGONAL_LINES, occupied)
+
+
+def get_stable_discs(own, full_lines):
+    """Vectorized Reversi.stability.get_stable_discs, given the position's get_full_lines."""
+    x_full, y_full, diagonal_full, anti_diagonal_full = full_lines
+    x_safe = own & (x_full | _X_BORDER)
+    y_safe = own & (y_full | _Y_BORDER)
+    diagonal_safe = own & (diagonal_full | _BORDER)
+    anti_diagonal_safe = own & (anti_diagonal_full | _BORDER)
+
+    one, seven, eight, nine = (np.uint64(shift) for shift in (1, 7, 8, 9))
+    stable = np.zeros_like(own)
+    while True:
+        new_stable = (
+            (x_safe | (stable << eight) | (stable >> eight)) &
+            (y_safe | ((stable << one) & _NOT_Y0) | ((stable >> one) & _NOT_Y7)) &
+            (diagonal_safe | ((stable << nine) & _NOT_Y0) | ((stable >> nine) & _NOT_Y7)) &
+            (anti_diagonal_safe | ((stable << seven) & _NOT_Y7) | ((stable >> seven) & _NOT_Y0))) & own
+        if np.array_equal(new_stable, stable):
+            return stable
+        stable = new_stable
+
+
+def pack_states(states):
+    """Packs GameStates into arrays.
+
+    :return: A tuple: (X discs, O discs, Whether X is to move), as arrays of length len(states).
+    """
+    x_discs = np.array([state.discs[X_PLAYER] for state in states], dtype=np.uint64)
+    o_discs = np.array([state.discs[O_PLAYER] for state in states], dtype=np.uint64)
+    x_to_move = np.array([state.curr_player == X_PLAYER for state in states], dtype=bool)
+    return x_discs, o_discs, x_to_move
+
+
+def pack_children(state, moves):
+    """Packs the states reached by each of the given moves, like pack_states. The state itself is unchanged."""
+    x_discs, o_discs, x_to_move = [], [], []
+    for move in moves:
+        undo = state.make_move(move[0], move[1])
+        x_discs.append(state.discs[X_PLAYER])
+        o_discs.append(state.discs[O_PLAYER])
+        x_to_move.append(state.curr_player == X_PLAYER)
+        state.unmake_move(undo)
+    return np.array(x_discs, dtype=np.uint64), np.array(o_discs, dtype=np.uint64), np.array(x_to_move, dtype=bool)
+
+
+class BatchEvaluator:
+
+    def __init__(self, color, positions, stable_disc_weight):
+        """Initialize a batch evaluator, giving the same scores as better_player's hand-tuned Player.utility.
+
+        :param color: The color of the player the scores are for.
+        :param positions: The 8x8 square weights table (better_player.POSITIONS), indexed [x][y].
+        :param stable_disc_weight: What a stable disc adds to the stability term (better_player.STABLE_DISC_WEIGHT).
+        """
+        self.color = color
+        self.stable_disc_weight = stable_disc_weight
+        self.positions = np.array(positions, dtype=np.float64).reshape(BOARD_ROWS * BOARD_COLS)
+
+    def evaluate_states(self, states):
+        """Evaluates a list of GameStates. Returns an array of scores."""
+        return self.evaluate(*pack_states(states))
+
+    def evaluate(self, x_discs, o_discs, x_to_move):
+        """Evaluates N positions at once.
+
+        :param x_discs: uint64 array of the X discs.
+        :param o_discs: uint64 array of the O discs.
+        :param x_to_move: bool array, whether X is the player to move.
+        :return: A float array of N scores.
+        """
+        me = np.array(x_discs if self.color == X_PLAYER else o_discs, dtype=np.uint64)
+        op = np.array(o_discs if self.color == X_PLAYER else x_discs, dtype=np.uint64)
+        my_turn = np.array(x_to_move if self.color == X_PLAYER else ~np.asarray(x_to_move), dtype=bool)
+
+        scores = np.zeros(len(me), dtype=np.float64)
+        done = np.zeros(len(me), dtype=bool)
+
+        # Exhaust no-brainer states: play forced moves until there's a choice or the game is decided
+        while True:
+            active = ~done
+            if not active.any():
+                break
+            own = np.where(my_turn, me, op)
+            other = np.where(my_turn, op, me)
+            moves = get_moves_masks(own, other)
+            reverse_moves = get_moves_masks(op, me)
+
+            curr_moves = popcount(moves)
+            op_moves = popcount(reverse_moves)
+            my_units = popcount(me)
+            op_units = popcount(op)
+
+            decided = active & ((my_units == 0) | (op_units == 0) | (curr_moves == 0) | (op_moves == 0))
+            scores[decided] = np.where(my_units[decided] == op_units[decided], 0.0,
+                                       np.where(my_units[decided] < op_units[decided], -INFINITY, INFINITY))
+            done |= decided
+
+            forced = active & ~decided & (curr_moves == 1)
+            evaluate = active & ~decided & ~forced
+            if evaluate.any():
+                scores[evaluate] = self._heuristic(me[evaluate], op[evaluate], my_turn[evaluate],
+                                                   curr_moves[evaluate], op_moves[evaluate])
+                done |= evaluate
+
+            if not forced.any():
+                break
+            move = moves[forced]
+            flips = get_flips_masks(own[forced], other[forced], move)
+            new_own = own[forced] | flips | move
+            new_other = other[forced] & ~flips
+            was_my_turn = my_turn[forced]
+            me[forced] = np.where(was_my_turn, new_own, new_other)
+            op[forced] = np.where(was_my_turn, new_other, new_own)
+            my_turn[forced] = ~was_my_turn
+
+        return scores
+
+    def _heuristic(self, me, op, my_turn, my_moves, op_moves):
+        my_units = popcount(me)
+        op_units = popcount(op)
+        units = my_units + op_units
+
+        my_bits = np.unpackbits(me.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little').astype(np.int64)
+        op_bits = np.unpackbits(op.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little').astype(np.int64)
+
+        # Coin Parity
+        p = 100 * (my_units - op_units) / units.astype(np.float64)
+
+        # Mobility
+        total_moves = my_moves + op_moves
+        m = np.where(total_moves == 0, 0.0, 100 * (my_moves - op_moves) / np.maximum(total_moves, 1).astype(np.float64))
+
+        # Stability
+        full_lines = get_full_lines(me | op)
+        my_stab = my_bits.dot(self.positions) + self.stable_disc_weight * popcount(get_stable_discs(me, full_lines))
+        op_stab = op_bits.dot(self.positions) + self.stable_disc_weight * popcount(get_stable_discs(op, full_lines))
+        total_stab = my_stab + op_stab
+        s = np.where(total_stab == 0, 0.0, 50 * (my_stab - op_stab) / np.where(total_stab == 0, 1.0, total_stab))
+
+        # Corner Occupancy
+        my_corners = my_bits[:, _CORNERS].sum(axis=1)
+        op_corners = op_bits[:, _CORNERS].sum(axis=1)
+        c = 25 * (my_corners - op_corners).astype(np.float64)
+
+        # Corner Closeness
+        empty_corners = (my_bits[:, _CORNERS] | op_bits[:, _CORNERS]) == 0
+        my_close = (my_bits[:, _CORNER_NEIGHBOURS].sum(axis=2) * empty_corners).sum(axis=1)
+        op_close = (op_bits[:, _CORNER_NEIGHBOURS].sum(axis=2) * empty_corners).sum(axis=1)
+        total_close = my_close + op_close
+        l = np.where(total_close == 0, 0.0, 100 * (my_close - op_close) / np.maximum(total_close, 1).astype(np.float64))
+
+        h = np.zeros(len(me), dtype=np.float64)
+        low = 0
+        for high, w in _WEIGHT_BANDS:
+            band = (units >= low) & (units < high)
+            h[band] = 0 + p[band] * w[0] + c[band] * w[1] + l[band] * w[2] + m[band] * w[3] + s[band] * w[4]
+            low = high
+
+        return np.where(my_turn, h, -h)
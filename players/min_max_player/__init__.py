@@ -1,41 +1,222 @@
 import abstract
 import random
-from utils import MiniMaxAlgorithm, INFINITY, provide_while
-from players.better_player import Player as ParentPlayer
-import time
+import multiprocessing
+import threading
+import numpy as np
+from functools import partial
+from utils import (MiniMaxAlgorithm, INFINITY, ExceededTimeError, SearchStats, EvaluationCache, SelectiveDeepening,
+                   TranspositionTable, MoveOrdering)
+from players.better_player import Player as ParentPlayer, POSITIONS
+from Reversi.consts import BOARD_ROWS, BOARD_COLS
+from Reversi.endgame import EndgameSolver
+from players.min_max_player.parallel import SearchPool
+
+# With this many empty squares or less, the game is solved exactly instead of searched, for players not given their
+# own threshold. Read when a player is made, so it can be changed.
+ENDGAME_EMPTIES = 12
+
+# The number of leaf evaluations kept for the whole game. The same leaves come back at every iteration.
+EVALUATION_CACHE_ENTRIES = 100000
+
+# Selective deepening budget: plies past the search depth per line, and extended states per move. Extensions are off
+# by default - they cost more depth than they gained in self-play. Set EXTENSION_NODES before making a player (or a
+# player's selective_deepening.max_nodes) to turn them on.
+EXTENSION_PLIES = 2
+EXTENSION_NODES = 0
+
+# Memory cap of the transposition table kept for the whole game, in bytes.
+TRANSPOSITION_TABLE_MEMORY = 32 * 1024 * 1024
+
+# Processes searching the root moves alongside the player's own process, for players not given their own number.
+# Read when a player is made, so it can be changed: run_game's 'parallel' sets it to one per extra core.
+SEARCH_WORKERS = 0
 
 class Player(ParentPlayer):
-    def __init__(self, setup_time, player_color, time_per_k_turns, k, alg = None):
+    # Subclasses searching with a TranspositionTable set it here. Pondering only helps through the table.
+    transposition_table = None
+    # Subclasses searching with a ProbCut set it here, for the stats
+    probcut = None
+
+    def __init__(self, setup_time, player_color, time_per_k_turns, k, alg = None, endgame_empties = None,
+                 search_workers = None):
         ParentPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k)
+        if endgame_empties is None:
+            endgame_empties = ENDGAME_EMPTIES
+        if search_workers is None:
+            search_workers = SEARCH_WORKERS
 
         self._alg = alg or MiniMaxAlgorithm
+        self.evaluation_cache = EvaluationCache(self.utility, EVALUATION_CACHE_ENTRIES)
+        self.selective_deepening = SelectiveDeepening(self.selective_deepening_criterion, EXTENSION_PLIES,
+                                                      EXTENSION_NODES)
+        self.endgame_empties = endgame_empties
+        self.search_pool = None
+        # The SearchStats of the last move, when collect_stats is set
+        self.search_stats = None
+        self._ponder_thread = None
+        self._ponder_stop = None
+        self._pondered_key = None
+        # Whether the opponent played the reply we pondered on, at the last stop_pondering
+        self.ponder_hit = False
+
+        # Only a game's main process starts search workers. A player that already runs in a worker process (the
+        # 'process' mode, a tournament, or a search worker itself) searches on its own.
+        if search_workers > 0 and multiprocessing.current_process().name == 'MainProcess':
+            try:
+                self.search_pool = SearchPool(self.__class__, (setup_time, player_color, time_per_k_turns, k),
+                                              search_workers, setup_time / 2)
+            except (ExceededTimeError, MemoryError, OSError):
+                self.search_pool = None
 
-    def get_move(self, game_state, possible_moves):
+    def new_search(self):
+        """Called before each move's search, in the player's process and in its search workers."""
+        pass
+
+    def _prepare_search(self):
+        """Starts a move's search: new_search, and the per move state of the evaluation cache and the extensions."""
+        self.new_search()
+        self.evaluation_cache.new_search()
+        self.selective_deepening.new_search()
+
+    def _get_move(self, game_state, possible_moves):
+        self.search_stats = None
         if len(possible_moves) == 1:
             return possible_moves[0]
 
-        self.clock = time.time()
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        self._prepare_search()
+        cache_hits = self.evaluation_cache.hits
+        probcut_cuts = self.probcut.cuts if self.probcut is not None else 0
+        stats = self.search_stats = SearchStats() if self.collect_stats else None
+        res = self._solve_endgame(game_state)
+        if res is None:
+            # Searched in place, with the evaluation terms kept up to date as moves are made
+            game_state = self.search_state(game_state)
+            alg = self._alg(self.evaluation_cache, self.color, self.no_more_time, self.selective_deepening,
+                            stats=stats)
+            if self.search_pool is not None:
+                runs = self._parallel_runs(alg, game_state, possible_moves)
+            else:
+                runs = (alg.search(game_state, d) for d in range(1, int(INFINITY)))
+            # Iterations that can't finish in the move's time are not started
+            runs = self.time_manager.iterations(runs)
+
+            # Get final run, unless no time for move and then just any move
+            res = list(runs)
+            if stats is not None:
+                # Iterative deepening starts at depth 1
+                stats.depth = len(res)
+            res = (res or [(None, None)])[-1][1]
+            res = res or possible_moves[random.choice(range(len(possible_moves)))]
 
-        alg = self._alg(self.utility, self.color, self.no_more_time, None)
-        runs = (alg.search(game_state, d) for d in range(1, int(INFINITY)))
-        runs = provide_while(runs, self.no_more_time)
+        if stats is not None:
+            stats.evaluation_cache_hits = self.evaluation_cache.hits - cache_hits
+            stats.extensions = self.selective_deepening.extensions
+            stats.probcut_cuts = self.probcut.cuts - probcut_cuts if self.probcut is not None else 0
+            stats.ponder_hit = self.ponder_hit
+            stats.stop()
+        return res
 
-        # Get final run, unless no time for move and then just any move
-        res = list(runs)
-        res = (res or [(None, None)])[-1][1]
-        res = res or possible_moves[random.choice(range(len(possible_moves)))]
+    def get_search_stats(self):
+        """The stats of this process' search for the last move. Search workers keep no stats."""
+        return self.search_stats.as_dict() if self.search_stats is not None else None
 
-        if self.turns_remaining_in_round == 1:
-            self.turns_remaining_in_round = self.k
-            self.time_remaining_in_round = self.time_per_k_turns
-        else:
-            self.turns_remaining_in_round -= 1
-            self.time_remaining_in_round -= (time.time() - self.clock)
+    def _parallel_runs(self, alg, game_state, possible_moves):
+        """Yields the iterative deepening runs of a search shared with the search workers."""
+        end = self.time_manager.end_time()
+        moves = list(possible_moves)
+        for d in range(1, int(INFINITY)):
+            try:
+                res = self.search_pool.search(alg, game_state, moves, d, end, self.no_more_time, d == 1)
+            except (ExceededTimeError, MemoryError, EOFError, OSError):
+                # A worker is stuck or gone, so this player searches on its own from now on
+                self.search_pool.close()
+                self.search_pool = None
+                return
+            yield res
 
-        return res
+            # The next iteration starts with the best move so far
+            if res[1] is not None:
+                moves.remove(res[1])
+                moves.insert(0, res[1])
+
+    def start_pondering(self, game_state):
+        """Searches the position after the opponent's expected reply in a background thread, until stop_pondering.
+        The results are kept in the transposition table, so if the opponent plays that reply, the next search gets
+        through the depths pondered on right away. Otherwise they're just outscored by the new search.
+        """
+        if self.transposition_table is None:
+            return
+
+        moves = game_state.get_possible_moves()
+        if not moves:
+            return
+        # The reply that is worst for us by our evaluation
+        reply = moves[int(np.argmin(self.evaluate_moves(game_state, moves)))]
+
+        state = self.search_state(game_state)
+        state.make_move(reply[0], reply[1])
+        # The endgame is solved instead of searched, so there's nothing to reuse
+        if BOARD_ROWS * BOARD_COLS - state.disc_count <= self.endgame_empties or not state.get_possible_moves():
+            return
+
+        self._pondered_key = state.zobrist_key
+        self._ponder_stop = threading.Event()
+        self._ponder_thread = threading.Thread(target=self._ponder, args=(state, self._ponder_stop))
+        self._ponder_thread.daemon = True
+        self._ponder_thread.start()
+
+    def _ponder(self, state, stop):
+        self._prepare_search()
+        # What is evaluated here is cached for the next move too, if the cache is persistent
+        alg = self._alg(self.evaluation_cache, self.color, stop.is_set, self.selective_deepening)
+        for d in range(1, int(INFINITY)):
+            alg.search(state, d)
+            if stop.is_set():
+                return
+
+    def stop_pondering(self, game_state):
+        if self._ponder_thread is None:
+            self.ponder_hit = False
+            return
+
+        self._ponder_stop.set()
+        self._ponder_thread.join()
+        self._ponder_thread = None
+        self.ponder_hit = game_state is not None and game_state.zobrist_key == self._pondered_key
+
+    def _solve_endgame(self, game_state):
+        """Returns the perfect move when few enough squares are left, or None.
+        The solver gets half the move's maximum time, so the regular search can still run if it doesn't finish.
+        """
+        if BOARD_ROWS * BOARD_COLS - game_state.disc_count > self.endgame_empties:
+            return None
+
+        solver = EndgameSolver(lambda: self.time_manager.elapsed() >= self.time_manager.maximum / 2)
+        solved = solver.solve(game_state)
+        if self.search_stats is not None:
+            self.search_stats.nodes += solver.nodes
+        return solved[1] if solved is not None else None
 
     def __repr__(self):
         return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'min_max')
 
+
+class TableSearchPlayer(Player):
+    def __init__(self, setup_time, player_color, time_per_k_turns, k, alg, endgame_empties = None,
+                 search_workers = None):
+        """A Player whose search keeps a TranspositionTable and a MoveOrdering for the whole game, the base of
+        alpha_beta_player and pvs_player.
+
+        :param alg: The search algorithm class. It's given the table and the ordering as keyword arguments.
+        """
+        self.transposition_table = TranspositionTable(TRANSPOSITION_TABLE_MEMORY)
+        self.move_ordering = MoveOrdering(static_weights=POSITIONS)
+        Player.__init__(self, setup_time, player_color, time_per_k_turns, k,
+                        partial(alg, transposition_table=self.transposition_table, move_ordering=self.move_ordering),
+                        endgame_empties=endgame_empties, search_workers=search_workers)
+
+    def new_search(self):
+        self.transposition_table.new_search()
+        self.move_ordering.new_search()
+
 # c:\python35\python run_game.py 3 3 3 y random_player random_player
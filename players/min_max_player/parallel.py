@@ -0,0 +1,176 @@
+"""Root-splitting parallel search for the min_max player and its subclasses.
+
+Each worker process holds its own copy of the player (with its own transposition table and move ordering), and
+they all pull root moves from a shared counter. The best root score found so far is kept in shared memory, and every
+root move is searched with it as alpha, so a cut-off found by one process narrows the window of the others.
+The first root move is searched alone before the others are shared out (young brothers wait), so there is a real
+bound to share from the start.
+"""
+import multiprocessing
+import time
+from multiprocessing import Process, Pipe
+from utils import INFINITY, MiniMaxAlgorithm, ExceededTimeError
+
+
+def search_root_move(alg, state, move, depth, alpha):
+    """Searches one root move with the given algorithm.
+
+    :return: The value of the move for the root player. A value not above alpha is only an upper bound.
+    """
+    undo = state.make_move(move[0], move[1])
+    try:
+        # Plain minimax has no window, the others get the shared alpha
+        if isinstance(alg, MiniMaxAlgorithm):
+            return alg.search(state, depth - 1, False)[0]
+        return alg.search(state, depth - 1, alpha, INFINITY, False)[0]
+    finally:
+        state.unmake_move(undo)
+
+
+def search_shared_moves(alg, state, moves, depth, alpha, next_move, no_more_time):
+    """Takes root moves off the shared counter and searches them until there are none left or the time is up.
+
+    :param alpha: A multiprocessing.Value of the best root score so far.
+    :param next_move: A multiprocessing.Value of the index of the next move to search.
+    :return: A list of (move index, value) tuples for the moves that were searched to the end.
+    """
+    results = []
+    while not no_more_time():
+        with next_move.get_lock():
+            i = next_move.value
+            next_move.value += 1
+        if i >= len(moves):
+            break
+
+        value = search_root_move(alg, state, moves[i], depth, alpha.value)
+        if no_more_time():
+            break
+
+        with alpha.get_lock():
+            if value > alpha.value:
+                alpha.value = value
+        results.append((i, value))
+    return results
+
+
+def _search_worker_main(connection, player_class, args, alpha, next_move):
+    """The loop of a search worker: creates its own player, then searches the moves it gets from the shared
+    counter until told to stop.
+    """
+    try:
+        player = player_class(*args)
+        connection.send(True)
+    except Exception as e:
+        connection.send(e)
+        return
+
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            # The player's process is gone
+            return
+        if request is None:
+            return
+
+        state, depth, moves, end, new_search = request
+        if new_search:
+            player._prepare_search()
+        no_more_time = lambda: time.time() >= end
+        alg = player._alg(player.evaluation_cache, player.color, no_more_time, player.selective_deepening)
+        connection.send(search_shared_moves(alg, state, moves, depth, alpha, next_move, no_more_time))
+
+
+class SearchPool:
+
+    def __init__(self, player_class, args, workers, time_limit):
+        """Starts worker processes searching root moves alongside the player's process. The workers stay alive for
+        the whole game.
+
+        :param player_class: The player class. Each worker creates its own player with it.
+        :param args: The player's constructor arguments, as tuple.
+        :param workers: The number of worker processes.
+        :param time_limit: The time limit for starting the workers in seconds (can be float).
+        :raises PlayerExceededTimeError: If the workers were not ready in time.
+        """
+        self.alpha = multiprocessing.Value('d', -INFINITY)
+        self.next_move = multiprocessing.Value('i', 0)
+        self._connections = []
+        self._processes = []
+        for _ in range(workers):
+            connection, child_connection = Pipe()
+            process = Process(target=_search_worker_main,
+                              args=(child_connection, player_class, args, self.alpha, self.next_move))
+            process.daemon = True
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        end = time.time() + time_limit
+        for connection in self._connections:
+            self._receive(connection, end - time.time())
+
+    def _receive(self, connection, time_limit):
+        if not connection.poll(max(time_limit, 0)):
+            self.close()
+            raise ExceededTimeError
+        try:
+            reply = connection.recv()
+        except EOFError:
+            self.close()
+            raise MemoryError
+        if isinstance(reply, Exception):
+            self.close()
+            raise reply
+        return reply
+
+    def search(self, alg, state, moves, depth, end, no_more_time, new_search):
+        """Searches the root to the given depth, with the work split between this process and the workers.
+
+        :param alg: The search algorithm of this process.
+        :param state: The root state. It's searched in place, and is left unchanged.
+        :param moves: The root moves, the most promising first.
+        :param depth: The depth to search to.
+        :param end: The time.time() by which the workers stop searching.
+        :param no_more_time: The time check of this process.
+        :param new_search: Whether this is the first search of a move, so the workers start a new search too.
+        :return: A tuple: (The value, The best move), like the algorithms' search. The move is None if the time ran
+                 out before the first move was searched.
+        :raises PlayerExceededTimeError: If a worker didn't answer by the end time.
+        """
+        # Young brothers wait: the first move is searched alone, to get a bound to share
+        value = search_root_move(alg, state, moves[0], depth, -INFINITY)
+        if no_more_time():
+            return -INFINITY, None
+        values = {0: value}
+
+        self.alpha.value = value
+        self.next_move.value = 1
+        request = (state, depth, moves, end, new_search)
+        for connection in self._connections:
+            connection.send(request)
+
+        values.update(search_shared_moves(alg, state, moves, depth, self.alpha, self.next_move, no_more_time))
+        for connection in self._connections:
+            # The workers stop by the end time, and get a little slack to send their results
+            values.update(self._receive(connection, end - time.time() + 1))
+
+        # The best score is exact: it was searched with an alpha below it. Ties go to the earlier move.
+        best = max(sorted(values), key=lambda i: values[i])
+        return values[best], moves[best]
+
+    def close(self):
+        for connection, process in zip(self._connections, self._processes):
+            if process.is_alive():
+                try:
+                    connection.send(None)
+                except (OSError, ValueError):
+                    pass
+                process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self._connections = []
+        self._processes = []
+
+    def __len__(self):
+        return len(self._processes)
@@ -0,0 +1,26 @@
+import abstract
+from functools import partial
+from utils import PrincipalVariationSearch, ProbCut
+from players.better_player import HAND_TUNED_PROBCUT_MARGIN
+from players.min_max_player import TableSearchPlayer
+
+# ProbCut predicts a node's value by a search this many plies shallower, in nodes with at least PROBCUT_MIN_DEPTH left
+PROBCUT_REDUCTION = 2
+PROBCUT_MIN_DEPTH = 4
+
+class Player(TableSearchPlayer):
+    def __init__(self, setup_time, player_color, time_per_k_turns, k, alg = None, search_workers = None,
+                 endgame_empties = None):
+        self.probcut = ProbCut(HAND_TUNED_PROBCUT_MARGIN, PROBCUT_REDUCTION, PROBCUT_MIN_DEPTH)
+        TableSearchPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k,
+                                   partial(PrincipalVariationSearch, probcut=self.probcut),
+                                   endgame_empties=endgame_empties, search_workers=search_workers)
+        # The margin and the aspiration window are in the evaluation's units, which are known once the pattern
+        # weights are loaded (or not)
+        self.probcut.margin = self.probcut_margin
+        self._alg = partial(self._alg, aspiration_window=self.aspiration_window)
+
+    def __repr__(self):
+        return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'pvs')
+
+# c:\python35\python run_game.py 3 3 3 y pvs_player alpha_beta_player
@@ -4,9 +4,9 @@
 #===============================================================================
 
 import abstract
-from utils import INFINITY, run_with_limited_time, ExceededTimeError
-from Reversi.consts import EM, OPPONENT_COLOR, BOARD_COLS, BOARD_ROWS
-import time
+from utils import INFINITY, run_with_limited_time, ExceededTimeError, TimeManager, EvaluationCache
+from Reversi.consts import EM, OPPONENT_COLOR
+from Reversi.board import popcount
 import copy
 from collections import defaultdict
 
@@ -17,17 +17,18 @@ from collections import defaultdict
 class Player(abstract.AbstractPlayer):
     def __init__(self, setup_time, player_color, time_per_k_turns, k):
         abstract.AbstractPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k)
-        self.clock = time.time()
-
-        # We are simply providing (remaining time / remaining turns) for each turn in round.
-        # Taking a spare time of 0.05 seconds.
-        self.turns_remaining_in_round = self.k
-        self.time_remaining_in_round = self.time_per_k_turns
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        self.time_manager = TimeManager(self.time_per_k_turns, self.k)
+        # The best state so far is compared with every move's, so its value is looked up rather than recomputed
+        self.evaluation_cache = EvaluationCache(self.utility)
 
     def get_move(self, game_state, possible_moves):
-        self.clock = time.time()
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        self.time_manager.start_move(self.deadline)
+        try:
+            return self._get_move(game_state, possible_moves)
+        finally:
+            self.time_manager.end_move()
+
+    def _get_move(self, game_state, possible_moves):
         if len(possible_moves) == 1:
             return possible_moves[0]
 
@@ -39,31 +40,18 @@ class Player(abstract.AbstractPlayer):
         for move in possible_moves:
             new_state = copy.deepcopy(game_state)
             new_state.perform_move(move[0],move[1])
-            if self.utility(new_state) > self.utility(next_state):
+            if self.evaluation_cache(new_state) > self.evaluation_cache(next_state):
                 next_state = new_state
                 best_move = move
 
-        if self.turns_remaining_in_round == 1:
-            self.turns_remaining_in_round = self.k
-            self.time_remaining_in_round = self.time_per_k_turns
-        else:
-            self.turns_remaining_in_round -= 1
-            self.time_remaining_in_round -= (time.time() - self.clock)
-
         return best_move
 
     def utility(self, state):
         if len(state.get_possible_moves()) == 0:
             return INFINITY if state.curr_player != self.color else -INFINITY
 
-        my_u = 0
-        op_u = 0
-        for x in range(BOARD_COLS):
-            for y in range(BOARD_ROWS):
-                if state.board[x][y] == self.color:
-                    my_u += 1
-                if state.board[x][y] == OPPONENT_COLOR[self.color]:
-                    op_u += 1
+        my_u = popcount(state.discs[self.color])
+        op_u = popcount(state.discs[OPPONENT_COLOR[self.color]])
 
         if my_u == 0:
             # I have no tools left
@@ -79,7 +67,7 @@ class Player(abstract.AbstractPlayer):
         return False
 
     def no_more_time(self):
-        return (time.time() - self.clock) >= self.time_for_current_move
+        return self.time_manager.no_more_time()
 
     def __repr__(self):
         return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'simple')
@@ -2,14 +2,27 @@
 A generic turn-based game runner.
 """
 import sys
+import json
+import logging
+import multiprocessing
 from Reversi.board import GameState
 from Reversi.consts import X_PLAYER, O_PLAYER, TIE, OPPONENT_COLOR
 import utils
-import copy
 import players.interactive
 
+# Ways to run the players
+IN_PROCESS = 'inprocess'  # In this thread, players stop cooperatively at their deadline.
+PROCESS = 'process'  # Each player in a worker process that is killed if it overruns. Players may ponder.
+
+# Time limit in seconds for a player to start or stop pondering
+PONDER_TIME_LIMIT = 0.5
+
+# Per move search stats are logged here, as one JSON object per message
+stats_logger = logging.getLogger('run_game.stats')
+
 class GameRunner:
-    def __init__(self, setup_time, time_per_k_turns, k, verbose, x_player, o_player):
+    def __init__(self, setup_time, time_per_k_turns, k, verbose, x_player, o_player, mode=IN_PROCESS, headless=False,
+                 log_stats=False):
         """Game runner initialization.
 
         :param setup_time: Setup time allowed for each player in seconds.
@@ -20,12 +33,18 @@ class GameRunner:
         :param x_player: The name of the module containing the x player. E.g. "myplayer" will invoke an
             equivalent to "import players.myplayer" in the code.
         :param o_player: Same as 'x_player' parameter, but for the other player.
+        :param mode: IN_PROCESS ('inprocess') or PROCESS ('process'). The interactive player always runs in process.
+        :param headless: Print nothing at all, not even the result (overrides verbose). For bulk games.
+        :param log_stats: Ask the players to keep search stats, and log them to stats_logger after every move.
         """
 
-        self.verbose = verbose.lower()
+        self.headless = headless
+        self.verbose = 'n' if headless else verbose.lower()
         self.setup_time = float(setup_time)
         self.time_per_k_turns = float(time_per_k_turns)
         self.k = int(k)
+        self.mode = mode.lower()
+        self.log_stats = log_stats
         self.players = {}
 
         # Dynamically importing the players. This allows maximum flexibility and modularity.
@@ -46,6 +65,10 @@ class GameRunner:
             X_PLAYER : utils.INFINITY if x_is_interactive else self.time_per_k_turns,
             O_PLAYER: utils.INFINITY if o_is_interactive else self.time_per_k_turns,
         }
+        self.player_in_process = {
+            X_PLAYER: self.mode == PROCESS and not x_is_interactive,
+            O_PLAYER: self.mode == PROCESS and not o_is_interactive,
+        }
 
     def setup_player(self, player_class, player_type):
         """ An auxiliary function to populate the players list, and measure setup times on the go.
@@ -54,19 +77,84 @@ class GameRunner:
         :param player_type: Player type, passed as an argument to the player.
         :return: A boolean. True if the player exceeded the given time. False otherwise.
         """
+        args = (self.setup_time, player_type, self.time_per_k_turns, self.k)
         try:
-            player, measured_time = utils.run_with_limited_time(
-                player_class, (self.setup_time, player_type, self.time_per_k_turns, self.k), {}, self.setup_time*1.5)
-        except MemoryError:
+            if self.player_in_process[player_type]:
+                player = utils.PlayerProcess(player_class, args, self.setup_time*1.5)
+                measured_time = player.setup_runtime
+            else:
+                player, measured_time = utils.run_with_limited_time(player_class, args, {}, self.setup_time*1.5)
+        except (utils.ExceededTimeError, MemoryError):
             return True
 
         self.players[player_type] = player
+        if self.log_stats:
+            try:
+                self.call(player_type, 'enable_stats', ())
+            except (utils.ExceededTimeError, MemoryError):
+                return True
         return measured_time > self.setup_time
 
+    def get_move(self, player_type, board_state, possible_moves, remaining_run_time):
+        """Asks a player for its move.
+
+        :return: A tuple: The move, and the player's running time.
+        :raises ExceededTimeError: If the player exceeded its time.
+        """
+        player = self.players[player_type]
+        if self.player_in_process[player_type]:
+            # The state is pickled, so the player gets its own copy
+            return player.call('get_move', (board_state, possible_moves), remaining_run_time, remaining_run_time*1.5)
+
+        player.deadline = utils.Deadline(remaining_run_time)
+        return utils.run_with_limited_time(
+            player.get_move, (board_state.copy(), possible_moves), {}, remaining_run_time*1.5)
+
+    def call(self, player_type, method, args, time_limit=PONDER_TIME_LIMIT):
+        """Calls one of the untimed player methods (pondering, stats), wherever the player runs.
+
+        :return: The method's return value.
+        :raises ExceededTimeError: If the player didn't return within the time limit.
+        """
+        player = self.players[player_type]
+        if self.player_in_process[player_type]:
+            return player.call(method, args, time_limit, time_limit)[0]
+        return getattr(player, method)(*args)
+
+    def ponder(self, player_type, method, board_state):
+        """Tells a player to start or stop pondering (thinking on the opponent's time). This is not counted as its
+        time. Only players running in their own process ponder, since in process they'd be taking the opponent's time.
+
+        :param method: 'start_pondering' or 'stop_pondering'.
+        :raises ExceededTimeError: If the player didn't return within PONDER_TIME_LIMIT.
+        """
+        if self.player_in_process[player_type]:
+            self.call(player_type, method, (board_state,))
+
+    def log_move_stats(self, player_type, move_number, move, run_time):
+        """Logs the player's search stats for the move it just made."""
+        record = {
+            'move_number': move_number,
+            'player': player_type,
+            'name': repr(self.players[player_type]),
+            'move': move,
+            'run_time': run_time,
+            'stats': self.call(player_type, 'get_search_stats', ()),
+        }
+        stats_logger.info(json.dumps(record))
+
     def run(self):
         """The main loop.
         :return: The winner.
         """
+        try:
+            return self.play()
+        finally:
+            for player in self.players.values():
+                if isinstance(player, utils.PlayerProcess):
+                    player.close()
+
+    def play(self):
         # Setup each player 
         x_player_exceeded = self.setup_player(sys.modules[self.x_player].Player, X_PLAYER)
         o_player_exceeded = self.setup_player(sys.modules[self.o_player].Player, O_PLAYER)
@@ -74,14 +162,17 @@ class GameRunner:
         if winner: # One of the players exceeded the setup time
             return winner
 
-        board_state = GameState()
-        remaining_run_times = copy.deepcopy(self.player_move_times)
+        # Kept on the runner so the final position can be inspected after the game.
+        self.board_state = board_state = GameState()
+        remaining_run_times = dict(self.player_move_times)
         k_count = 0
+        move_number = 0
+        verbose = self.verbose == 'y'
 
         # Running the actual game loop. The game ends if someone is left out of moves,
         # or exceeds his time.
         while True:
-            if self.verbose == 'y':
+            if verbose:
                 board_state.draw_board()
 
             player = self.players[board_state.curr_player]
@@ -91,30 +182,44 @@ class GameRunner:
                 if not possible_moves:
                     winner = self.make_winner_result(board_state.get_winner())
                     break
+                self.ponder(board_state.curr_player, 'stop_pondering', board_state)
+
                 # Get move from player
-                move, run_time = utils.run_with_limited_time(
-                    player.get_move, (copy.deepcopy(board_state), possible_moves), {}, remaining_run_time*1.5) ###
+                move, run_time = self.get_move(board_state.curr_player, board_state, possible_moves, remaining_run_time)
                 
                 remaining_run_times[board_state.curr_player] -= run_time
                 if remaining_run_times[board_state.curr_player] < 0:
                     raise utils.ExceededTimeError
             except (utils.ExceededTimeError, MemoryError):
-                print('Player {} exceeded resources.'.format(player))
+                if not self.headless:
+                    print('Player {} exceeded resources.'.format(player))
                 winner = self.make_winner_result(OPPONENT_COLOR[board_state.curr_player])
                 break
             
             board_state.perform_move(move[0],move[1])
-            if self.verbose == 'y':
+            move_number += 1
+            if self.log_stats:
+                self.log_move_stats(OPPONENT_COLOR[board_state.curr_player], move_number, move, run_time)
+            if verbose:
                 print('Player ' + repr(player) + ' performed the move: [' + str(move[0]) + ', ' + str(move[1]) + ']')
+
+            try:
+                self.ponder(OPPONENT_COLOR[board_state.curr_player], 'start_pondering', board_state)
+            except (utils.ExceededTimeError, MemoryError):
+                if not self.headless:
+                    print('Player {} exceeded resources.'.format(player))
+                winner = self.make_winner_result(board_state.curr_player)
+                break
             
             
             if board_state.curr_player == X_PLAYER:
                 k_count = (k_count + 1) % self.k
                 if k_count == 0:
                     # K rounds completed. Resetting timers.
-                    remaining_run_times = copy.deepcopy(self.player_move_times)
+                    remaining_run_times = dict(self.player_move_times)
 
-        self.end_game(winner)
+        if not self.headless:
+            self.end_game(winner)
         return winner
 
     @staticmethod
@@ -136,22 +241,37 @@ class GameRunner:
             winner = self.make_winner_result(TIE)
         elif x_player_exceeded:
             winner = self.make_winner_result(O_PLAYER)
-            print("time exceeded for x")
+            if not self.headless:
+                print("time exceeded for x")
         elif o_player_exceeded:
             winner = self.make_winner_result(X_PLAYER)
-            print("time exceeded for o")
+            if not self.headless:
+                print("time exceeded for o")
 
-        if winner:
+        if winner and not self.headless:
             self.end_game(winner)
 
         return winner
 
 
 if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = set()
+    while len(args) > 6 and args[-1] in ('stats', 'parallel'):
+        options.add(args.pop())
+    log_stats = 'stats' in options
+    if log_stats:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if 'parallel' in options:
+        import players.min_max_player
+        players.min_max_player.SEARCH_WORKERS = multiprocessing.cpu_count() - 1
     try:
-        GameRunner(*sys.argv[1:]).run()
+        GameRunner(*args, log_stats=log_stats).run()
     except TypeError:
-        print("""Syntax: {0} setup_time time_per_k_turns k verbose x_player o_player
+        print("""Syntax: {0} setup_time time_per_k_turns k verbose x_player o_player [mode] [stats] [parallel]
 For example: {0} 2 10 5 y interactive random_player
+mode is 'inprocess' (default) or 'process'.
+'stats' logs the players' search stats after every move, as JSON lines.
+'parallel' has the min-max players split their root search over the machine's cores (in-process only).
 Please read the docs in the code for more info.""".
               format(sys.argv[0]))
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+A batch tournament runner. Plays every pairing of the given players, in both colors, over a process pool,
+and writes a JSON/CSV report of the results.
+"""
+import argparse
+import collections
+import csv
+import itertools
+import json
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from Reversi.board import popcount
+from Reversi.consts import X_PLAYER, O_PLAYER, TIE
+from run_game import GameRunner
+
+INITIAL_RATING = 1500.0
+ELO_K = 16.0
+
+GameResult = collections.namedtuple('GameResult', ['index', 'x_player', 'o_player', 'winner', 'x_discs', 'o_discs'])
+
+
+def play_game(index, x_player, o_player, seed, setup_time, time_per_k_turns, k):
+    """Plays one game, quietly. Runs in a pool worker.
+
+    :return: A GameResult. Its winner is X_PLAYER, O_PLAYER or TIE.
+    """
+    random.seed(seed)
+    runner = GameRunner(setup_time, time_per_k_turns, k, 'n', x_player, o_player, headless=True)
+    winner = runner.run()
+
+    board_state = getattr(runner, 'board_state', None)
+    x_discs = popcount(board_state.discs[X_PLAYER]) if board_state else 0
+    o_discs = popcount(board_state.discs[O_PLAYER]) if board_state else 0
+    return GameResult(index, x_player, o_player, TIE if winner == TIE else winner[0], x_discs, o_discs)
+
+
+def schedule(player_names, games, seed):
+    """Yields the games to play: (index, x_player, o_player, seed) for every ordered pair of players."""
+    index = 0
+    for x_player, o_player in itertools.permutations(player_names, 2):
+        for _ in range(games):
+            yield index, x_player, o_player, seed + index
+            index += 1
+
+
+def expected_score(rating, other_rating):
+    return 1.0 / (1.0 + 10 ** ((other_rating - rating) / 400.0))
+
+
+def summarize(player_names, results):
+    """Aggregates the game results per player.
+
+    :param results: GameResults, in any order. Elo ratings are updated in game index order.
+    :return: A dict from player name to its stats dict.
+    """
+    stats = {name: {'games': 0, 'wins': 0, 'losses': 0, 'draws': 0, 'disc_differential': 0, 'elo': INITIAL_RATING}
+             for name in player_names}
+
+    for result in sorted(results, key=lambda r: r.index):
+        x_stats, o_stats = stats[result.x_player], stats[result.o_player]
+        x_score = 0.5 if result.winner == TIE else (1.0 if result.winner == X_PLAYER else 0.0)
+
+        for player_stats, score, diff in ((x_stats, x_score, result.x_discs - result.o_discs),
+                                          (o_stats, 1.0 - x_score, result.o_discs - result.x_discs)):
+            player_stats['games'] += 1
+            player_stats['disc_differential'] += diff
+            if score == 1.0:
+                player_stats['wins'] += 1
+            elif score == 0.0:
+                player_stats['losses'] += 1
+            else:
+                player_stats['draws'] += 1
+
+        x_expected = expected_score(x_stats['elo'], o_stats['elo'])
+        x_stats['elo'] += ELO_K * (x_score - x_expected)
+        o_stats['elo'] -= ELO_K * (x_score - x_expected)
+
+    for player_stats in stats.values():
+        games = player_stats['games'] or 1
+        player_stats['average_disc_differential'] = player_stats['disc_differential'] / games
+        player_stats['score'] = (player_stats['wins'] + 0.5 * player_stats['draws']) / games
+
+    return stats
+
+
+def run_tournament(player_names, games, seed, setup_time, time_per_k_turns, k, max_workers=None):
+    """Plays the whole tournament.
+
+    :param player_names: Player module names, as given to GameRunner.
+    :param games: Number of games per pairing per color.
+    :param seed: The random seed. Game i is played with seed + i.
+    :param max_workers: The process pool size, defaults to the number of CPUs.
+    :return: A tuple: (The GameResults in index order, The per player stats)
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(play_game, index, x_player, o_player, game_seed, setup_time, time_per_k_turns, k)
+                   for index, x_player, o_player, game_seed in schedule(player_names, games, seed)]
+        results = [future.result() for future in futures]
+
+    return results, summarize(player_names, results)
+
+
+def write_json(path, results, stats):
+    with open(path, 'w') as f:
+        json.dump({'players': stats, 'games': [result._asdict() for result in results]}, f, indent=2)
+
+
+def write_csv(path, results):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(GameResult._fields)
+        writer.writerows(results)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('players', nargs='+', help='player module names, e.g. alpha_beta_player')
+    parser.add_argument('--games', type=int, default=10, help='games per pairing per color')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--setup-time', type=float, default=2)
+    parser.add_argument('--time-per-k-turns', type=float, default=5)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help='process pool size (default: number of CPUs)')
+    parser.add_argument('--json', help='write the report as JSON to this path')
+    parser.add_argument('--csv', help='write the per game results as CSV to this path')
+    args = parser.parse_args(argv)
+
+    results, stats = run_tournament(args.players, args.games, args.seed, args.setup_time, args.time_per_k_turns,
+                                    args.k, args.workers)
+    if args.json:
+        write_json(args.json, results, stats)
+    if args.csv:
+        write_csv(args.csv, results)
+
+    for name, player_stats in sorted(stats.items(), key=lambda item: -item[1]['elo']):
+        print('{:<20} elo {:7.1f}  +{} -{} ={}  discs {:+.1f}'.format(
+            name, player_stats['elo'], player_stats['wins'], player_stats['losses'], player_stats['draws'],
+            player_stats['average_disc_differential']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,262 @@
+"""
+Self-play training of the pattern evaluation (Reversi.patterns).
+
+    python train.py generate data --games 1000 --players alpha_beta_player --time 0.05
+    python train.py fit data patterns.bin
+
+generate plays games between the given players over a process pool, each game opening with some random moves so the
+games differ, and streams every position with the game's final result to NPZ shards in the data directory, one
+shard per chunk of games as it finishes. fit reads the shards and fits the pattern tables of every game phase to the
+results with vectorized NumPy, and writes them as a weights file, which better_player loads at startup.
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import Deadline
+from Reversi.board import GameState, popcount
+from Reversi.consts import X_PLAYER, O_PLAYER, BOARD_ROWS, BOARD_COLS
+from Reversi.patterns import (PatternWeights, INSTANCES, ENTRIES, EMPTY_INDICES, PHASES, SCALE, get_phase)
+from players.better_player.batch import popcount as popcounts
+
+# Games per pool task, and per data shard
+CHUNK_SIZE = 20
+
+SQUARES_LOSS = 'squares'
+LOGISTIC_LOSS = 'logistic'
+
+# MULTIPLIERS[square, instance] is what the square's digit is multiplied by in the instance's index
+MULTIPLIERS = np.zeros((BOARD_ROWS * BOARD_COLS, len(INSTANCES)), dtype=np.int64)
+for _instance, (_pattern, _squares) in enumerate(INSTANCES):
+    for _place, _square in enumerate(_squares):
+        MULTIPLIERS[_square, _instance] = 3 ** _place
+
+
+def _make_player(name, color, time_per_move):
+    module = 'players.' + name
+    __import__(module)
+    return sys.modules[module].Player(0, color, time_per_move, 1)
+
+
+def play_game(seed, x_player, o_player, time_per_move, random_plies):
+    """Plays one game between the players, the first random_plies moves at random.
+
+    :return: A tuple: (The X discs of every position played from, Their O discs, The final X - O disc difference).
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    players = {X_PLAYER: _make_player(x_player, X_PLAYER, time_per_move),
+               O_PLAYER: _make_player(o_player, O_PLAYER, time_per_move)}
+
+    state = GameState()
+    x_discs, o_discs = [], []
+    while True:
+        moves = state.get_possible_moves()
+        if not moves:
+            break
+        x_discs.append(state.discs[X_PLAYER])
+        o_discs.append(state.discs[O_PLAYER])
+
+        if len(x_discs) <= random_plies:
+            move = rng.choice(moves)
+        else:
+            player = players[state.curr_player]
+            player.deadline = Deadline(time_per_move)
+            move = player.get_move(state.copy(), moves)
+        state.perform_move(move[0], move[1])
+
+    return x_discs, o_discs, popcount(state.discs[X_PLAYER]) - popcount(state.discs[O_PLAYER])
+
+
+def play_games(first_seed, games, player_names, time_per_move, random_plies):
+    """Plays the games with seeds first_seed .. first_seed + games - 1. Runs in a pool worker.
+    Game i is played by player_names[i % n] as X against player_names[i // n % n].
+
+    :return: A dict of record arrays, as written to a shard: the X and O discs of every position, the final X - O
+             disc difference of its game, and its game's seed.
+    """
+    x_discs, o_discs, results, seeds = [], [], [], []
+    n = len(player_names)
+    for seed in range(first_seed, first_seed + games):
+        game_x, game_o, result = play_game(seed, player_names[seed % n], player_names[seed // n % n], time_per_move,
+                                           random_plies)
+        x_discs.extend(game_x)
+        o_discs.extend(game_o)
+        results.extend([result] * len(game_x))
+        seeds.extend([seed] * len(game_x))
+    return {'x_discs': np.array(x_discs, dtype=np.uint64), 'o_discs': np.array(o_discs, dtype=np.uint64),
+            'results': np.array(results, dtype=np.int8), 'seeds': np.array(seeds, dtype=np.uint32)}
+
+
+def generate(data_dir, games, player_names, time_per_move, random_plies, seed=0, max_workers=None):
+    """Plays the games over a process pool, writing each chunk's records to a shard in data_dir as it finishes.
+
+    :return: The number of positions written.
+    """
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    positions = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(play_games, first_seed, min(CHUNK_SIZE, seed + games - first_seed), player_names,
+                                   time_per_move, random_plies): first_seed
+                   for first_seed in range(seed, seed + games, CHUNK_SIZE)}
+        for future in as_completed(futures):
+            records = future.result()
+            np.savez_compressed(os.path.join(data_dir, 'games-{:08d}.npz'.format(futures[future])), **records)
+            positions += len(records['results'])
+    return positions
+
+
+def load_records(data_path):
+    """Reads the records of a shard, or of every shard in a directory, into a single dict of arrays."""
+    paths = sorted(glob.glob(os.path.join(data_path, '*.npz'))) if os.path.isdir(data_path) else [data_path]
+    shards = []
+    for path in paths:
+        with np.load(path) as shard:
+            shards.append({name: shard[name] for name in shard.files})
+    if not shards:
+        raise ValueError('No records in {}'.format(data_path))
+    return {name: np.concatenate([shard[name] for shard in shards]) for name in shards[0]}
+
+
+def index_matrix(x_discs, o_discs):
+    """Vectorized Reversi.patterns.pattern_indices: the table index of every pattern instance (columns) of every
+    position (rows).
+    """
+    x_bits = np.unpackbits(np.ascontiguousarray(x_discs, dtype=np.uint64).view(np.uint8).reshape(-1, 8), axis=1,
+                           bitorder='little').astype(np.int64)
+    o_bits = np.unpackbits(np.ascontiguousarray(o_discs, dtype=np.uint64).view(np.uint8).reshape(-1, 8), axis=1,
+                           bitorder='little').astype(np.int64)
+    return (x_bits + 2 * o_bits).dot(MULTIPLIERS) + np.array(EMPTY_INDICES, dtype=np.int64)
+
+
+def _predict(weights, indices):
+    return weights[indices].sum(axis=1)
+
+
+def _sum_by_entry(indices, values):
+    """The transpose of _predict: adds each position's value to every entry it indexes."""
+    return np.bincount(indices.ravel(), weights=np.repeat(values, indices.shape[1]), minlength=ENTRIES)
+
+
+def fit_least_squares(indices, targets, l2, iterations):
+    """Fits the table entries to the targets by ridge regression, solving the normal equations with conjugate
+    gradients. Entries no position indexes stay 0.
+    """
+    weights = np.zeros(ENTRIES)
+    residual = _sum_by_entry(indices, targets)
+    direction = residual.copy()
+    norm = residual.dot(residual)
+    for _ in range(iterations):
+        if norm < 1e-12:
+            break
+        product = _sum_by_entry(indices, _predict(direction, indices)) + l2 * direction
+        step = norm / direction.dot(product)
+        weights += step * direction
+        residual -= step * product
+        new_norm = residual.dot(residual)
+        direction = residual + (new_norm / norm) * direction
+        norm = new_norm
+    return weights
+
+
+def fit_logistic(indices, targets, l2, iterations, learning_rate=1.0):
+    """Fits the table entries so that their sum is the log odds of the targets (1 for an X win, 0.5 for a tie, 0 for
+    a loss), by gradient ascent with a step per entry scaled down by how many positions index it.
+    """
+    weights = np.zeros(ENTRIES)
+    step = learning_rate / (indices.shape[1] * (np.bincount(indices.ravel(), minlength=ENTRIES) + l2))
+    for _ in range(iterations):
+        errors = targets - 1.0 / (1.0 + np.exp(-_predict(weights, indices)))
+        weights += step * (_sum_by_entry(indices, errors) - l2 * weights)
+    return weights
+
+
+def _targets(results, loss):
+    if loss == LOGISTIC_LOSS:
+        return np.where(results > 0, 1.0, np.where(results < 0, 0.0, 0.5))
+    return results.astype(np.float64)
+
+
+def _error(weights, indices, results, loss):
+    """The root mean squared error of the predicted disc differences, or the accuracy of the predicted winners."""
+    predictions = _predict(weights, indices)
+    if loss == LOGISTIC_LOSS:
+        return np.mean(np.sign(predictions) == np.sign(results))
+    return np.sqrt(np.mean((predictions - results) ** 2))
+
+
+def fit(records, loss=SQUARES_LOSS, phases=PHASES, l2=10.0, iterations=100, validation=0.1, scale=SCALE, log=None):
+    """Fits the pattern tables of every phase to the records.
+
+    :param loss: SQUARES_LOSS ('squares') fits the final disc difference. LOGISTIC_LOSS ('logistic') fits the log
+                 odds of X winning, so the scores are in those units rather than in discs.
+    :param l2: The ridge penalty. It keeps the rarely seen entries near 0.
+    :param validation: The fraction of the games held out to report the fit on. They're not fitted on.
+    :param log: Called with a line of text per phase, or None.
+    :return: The PatternWeights.
+    """
+    indices = index_matrix(records['x_discs'], records['o_discs'])
+    results = records['results'].astype(np.int64)
+    disc_counts = popcounts(records['x_discs'] | records['o_discs'])
+    held_out = (records['seeds'].astype(np.uint64) * np.uint64(2654435761) % np.uint64(1000)) < validation * 1000
+
+    tables = []
+    for phase in range(phases):
+        in_phase = get_phase(disc_counts, phases) == phase
+        train, test = in_phase & ~held_out, in_phase & held_out
+        fit_phase = fit_logistic if loss == LOGISTIC_LOSS else fit_least_squares
+        weights = fit_phase(indices[train], _targets(results[train], loss), l2, iterations)
+        tables.append(np.clip(np.round(weights * scale), -32768, 32767).astype(np.int16).tolist())
+        if log is not None:
+            log('phase {}: {} positions, {} held out, {} {:.3f} / {:.3f}'.format(
+                phase, train.sum(), test.sum(), 'accuracy' if loss == LOGISTIC_LOSS else 'rmse',
+                _error(weights, indices[train], results[train], loss),
+                _error(weights, indices[test], results[test], loss) if test.any() else float('nan')))
+
+    return PatternWeights(tables, scale)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    generate_parser = commands.add_parser('generate', help='play self-play games and write their positions')
+    generate_parser.add_argument('data', help='the directory to write the NPZ shards to')
+    generate_parser.add_argument('--games', type=int, default=1000)
+    generate_parser.add_argument('--players', default='alpha_beta_player', help='comma separated player module names')
+    generate_parser.add_argument('--time', type=float, default=0.05, help='seconds per move')
+    generate_parser.add_argument('--random-plies', type=int, default=10, help='random moves at the start of a game')
+    generate_parser.add_argument('--seed', type=int, default=0, help='game i is played with seed + i')
+    generate_parser.add_argument('--workers', type=int, default=None, help='process pool size (default: number of CPUs)')
+
+    fit_parser = commands.add_parser('fit', help='fit the pattern tables and write a weights file')
+    fit_parser.add_argument('data', help='an NPZ shard, or a directory of them')
+    fit_parser.add_argument('weights', help='the weights file to write, e.g. patterns.bin')
+    fit_parser.add_argument('--loss', choices=[SQUARES_LOSS, LOGISTIC_LOSS], default=SQUARES_LOSS)
+    fit_parser.add_argument('--phases', type=int, default=PHASES)
+    fit_parser.add_argument('--l2', type=float, default=10.0)
+    fit_parser.add_argument('--iterations', type=int, default=100)
+    fit_parser.add_argument('--validation', type=float, default=0.1, help='fraction of the games held out')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.command == 'generate':
+        positions = generate(args.data, args.games, args.players.split(','), args.time, args.random_plies, args.seed,
+                             args.workers)
+        print('{} positions written ({:.1f}s)'.format(positions, time.time() - start))
+    else:
+        weights = fit(load_records(args.data), args.loss, args.phases, args.l2, args.iterations, args.validation,
+                      log=print)
+        weights.save(args.weights)
+        print('{} written ({:.1f}s)'.format(args.weights, time.time() - start))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,13 +1,11 @@
 """Generic utility functions
 """
 # from __future__ import print_function
-from threading import Thread
-from multiprocessing import Queue
+from multiprocessing import Process, Pipe
 import time
-import copy
 import operator
 import collections
-from Reversi.consts import OPPONENT_COLOR
+from Reversi.consts import OPPONENT_COLOR, BOARD_ROWS, BOARD_COLS
 
 INFINITY = float(600000000)
 
@@ -18,28 +16,149 @@ class ExceededTimeError(RuntimeError):
     pass
 
 
-def function_wrapper(func, args, kwargs, result_queue):
+class Deadline:
+
+    def __init__(self, time_limit):
+        """A point in time a cooperative call has to return by. Players get one as their 'deadline' attribute
+        before each move, and should stop searching once it expired.
+
+        :param time_limit: Seconds from now, float.
+        """
+        self.end = time.time() + time_limit
+
+    def time_left(self):
+        return self.end - time.time()
+
+    def expired(self):
+        return time.time() >= self.end
+
+
+class TimeManager:
+
+    # Seconds kept aside on every move for the game runner's own overhead
+    SAFETY_MARGIN = 0.05
+    # A move may take up to this many times its share of the remaining time, and leaves the moves after it at least
+    # their share divided by this
+    MAX_STRETCH = 3.0
+    # The target time grows by this factor every time the best move changes between iterations
+    INSTABILITY_STRETCH = 1.5
+    # The effective branching factor assumed before there are two iterations to measure it from
+    DEFAULT_BRANCHING = 4.0
+
+    def __init__(self, time_per_k_turns, k):
+        """Splits the time the game runner gives per k turns between the moves.
+
+        The time saved on quick moves (forced moves, book moves) is banked for the rest of the round. A move gets
+        a target time - its share of what's left - which iterative deepening stretches when the best move keeps
+        changing, up to a hard maximum no search goes past.
+
+        :param time_per_k_turns: Allowed move calculation time per k turns.
+        :param k: The k above. The runner's round is k moves of this player.
+        """
+        self.time_per_k_turns = time_per_k_turns
+        self.k = k
+        self.turns_remaining_in_round = k
+        self.time_remaining_in_round = time_per_k_turns
+
+        self.move_start = time.time()
+        self.target = self.maximum = time_per_k_turns / k - self.SAFETY_MARGIN
+        self._iteration_times = []
+        self._last_best_move = None
+
+    def start_move(self, deadline=None):
+        """Starts the clock of a move, and sets its target and maximum times.
+
+        :param deadline: The Deadline the runner gave the player, optional. The move never goes past it.
+        """
+        self.move_start = time.time()
+        self._iteration_times = []
+        self._last_best_move = None
+
+        turns = self.turns_remaining_in_round
+        budget = self.time_remaining_in_round - self.SAFETY_MARGIN * turns
+        self.target = budget / turns
+        self.maximum = min(self.target * self.MAX_STRETCH, budget - (turns - 1) * self.target / self.MAX_STRETCH)
+        if deadline is not None:
+            self.maximum = min(self.maximum, deadline.time_left() - self.SAFETY_MARGIN)
+        self.target = min(self.target, self.maximum)
+
+    def end_move(self):
+        """Stops the clock of a move, and charges its time to the round. Must be called on every move."""
+        if self.turns_remaining_in_round == 1:
+            self.turns_remaining_in_round = self.k
+            self.time_remaining_in_round = self.time_per_k_turns
+        else:
+            self.turns_remaining_in_round -= 1
+            self.time_remaining_in_round -= self.elapsed()
+
+    def elapsed(self):
+        return time.time() - self.move_start
+
+    def end_time(self):
+        """The time.time() of the move's hard maximum."""
+        return self.move_start + self.maximum
+
+    def no_more_time(self):
+        """True once the move's hard maximum has passed. Searches must stop then."""
+        return self.elapsed() >= self.maximum
+
+    def predict_iteration_time(self):
+        """Predicts how long the next iterative deepening iteration takes: the last iteration's time, times the
+        growth from the iteration before it (the effective branching factor).
+        """
+        times = self._iteration_times
+        if not times:
+            return 0.0
+        if len(times) < 2 or times[-2] <= 0:
+            return times[-1] * self.DEFAULT_BRANCHING
+        return times[-1] * max(times[-1] / times[-2], 1.0)
+
+    def iteration_done(self, iteration_time, best_move):
+        """Records a finished iteration. A best move differing from the last iteration's stretches the target."""
+        self._iteration_times.append(iteration_time)
+        if self._last_best_move is not None and best_move != self._last_best_move:
+            self.target = min(self.target * self.INSTABILITY_STRETCH, self.maximum)
+        self._last_best_move = best_move
+
+    def can_start_iteration(self):
+        """Whether the next iteration is expected to finish within the target time."""
+        return self.elapsed() + self.predict_iteration_time() <= self.target
+
+    def iterations(self, runs):
+        """Runs iterative deepening with this move's time: yields the runs that finished in time, and stops before
+        starting one that isn't expected to finish.
+
+        :param runs: An iterator of the search results, (value, move) tuples, by increasing depth.
+        """
+        while True:
+            start = time.time()
+            res = next(runs, None)
+            # A run cut by the time limit is not complete
+            if res is None or self.no_more_time():
+                return
+            self.iteration_done(time.time() - start, res[1])
+            yield res
+            if not self.can_start_iteration():
+                return
+
+
+def function_wrapper(func, args, kwargs):
     """Runs the given function and measures its runtime.
 
     :param func: The function to run.
     :param args: The function arguments as tuple.
     :param kwargs: The function kwargs as dict.
-    :param result_queue: The inter-process queue to communicate with the parent.
     :return: A tuple: The function return value, and its runtime.
     """
     start = time.time()
-    try:
-        result = func(*args, **kwargs)
-    except MemoryError as e:
-        result_queue.put(e)
-        return
-
+    result = func(*args, **kwargs)
     runtime = time.time() - start
-    result_queue.put((result, runtime))
+    return result, runtime
 
 
 def run_with_limited_time(func, args, kwargs, time_limit):
-    """Runs a function with time limit
+    """Runs a function with time limit, in this thread. The function can't be stopped, so it has to cooperate -
+    players check the Deadline they were given - and the limit is checked once it returns.
 
     :param func: The function to run.
     :param args: The functions args, given as tuple.
@@ -48,26 +167,171 @@ def run_with_limited_time(func, args, kwargs, time_limit):
     :return: A tuple: The function's return value unchanged, and the running time for the function.
     :raises PlayerExceededTimeError: If player exceeded its given time.
     """
-    q = Queue()
-    t = Thread(target=function_wrapper, args=(func, args, kwargs, q))
-    t.start()
+    result, runtime = function_wrapper(func, args, kwargs)
+    if runtime > time_limit:
+        raise ExceededTimeError
+    return result, runtime
 
-    # This is just for limiting the runtime of the other thread, so we stop eventually.
-    # It doesn't really measure the runtime.
-    t.join(time_limit)
 
-    if t.is_alive():
-        raise ExceededTimeError
+def _player_process_main(connection, player_class, args):
+    """The loop of a PlayerProcess worker: creates the player, then runs its methods until told to stop."""
+    try:
+        player, runtime = function_wrapper(player_class, args, {})
+        connection.send((repr(player), runtime))
+    except Exception as e:
+        connection.send(e)
+        return
+
+    while True:
+        request = connection.recv()
+        if request is None:
+            return
+        method, method_args, time_limit = request
+        player.deadline = Deadline(time_limit)
+        try:
+            connection.send(function_wrapper(getattr(player, method), method_args, {}))
+        except Exception as e:
+            connection.send(e)
+
 
-    q_get = q.get()
-    if isinstance(q_get, MemoryError):
-        raise q_get
-    return q_get
+class PlayerProcess:
+
+    def __init__(self, player_class, args, time_limit):
+        """Creates a player in its own worker process, which stays alive for the whole game.
+        A player that exceeds its time limit is killed, instead of being left running.
+
+        :param player_class: The player class. Must be importable by the worker.
+        :param args: The player's constructor arguments, as tuple.
+        :param time_limit: The time limit for the construction in seconds (can be float).
+        :raises PlayerExceededTimeError: If the construction exceeded the time limit.
+        """
+        self._connection, child_connection = Pipe()
+        self._process = Process(target=_player_process_main, args=(child_connection, player_class, args))
+        self._process.daemon = True
+        self._process.start()
+
+        self._repr, self.setup_runtime = self._receive(time_limit)
+
+    def _receive(self, time_limit):
+        if not self._connection.poll(time_limit):
+            self.kill()
+            raise ExceededTimeError
+        try:
+            reply = self._connection.recv()
+        except EOFError:
+            # The worker died, most likely out of memory
+            raise MemoryError
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def call(self, method, args, deadline, time_limit):
+        """Runs a method of the player in the worker.
+
+        :param method: The method name, e.g. 'get_move'.
+        :param args: The method args, given as tuple. They are pickled, so the player gets its own copy.
+        :param deadline: The seconds the player is told it has (its Deadline).
+        :param time_limit: The time limit in seconds after which the worker is killed.
+        :return: A tuple: The method's return value, and its running time.
+        :raises PlayerExceededTimeError: If the player exceeded the time limit.
+        """
+        self._connection.send((method, args, deadline))
+        return self._receive(time_limit)
+
+    def close(self):
+        if self._process.is_alive():
+            self._connection.send(None)
+            self._process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+
+    def __repr__(self):
+        return self._repr
+
+
+# Search phases timed by SearchStats
+MOVE_GENERATION = 'move_generation'
+EVALUATION = 'evaluation'
+MAKE_MOVE = 'make_move'  # Making and taking back moves, which replaced copying the states
+
+
+class SearchStats:
+
+    def __init__(self):
+        """Counters of a search's work, filled in by the search algorithms when given one. Timing the phases costs
+        some speed, so searches only keep stats when asked to.
+        """
+        self.nodes = 0
+        self.leaves = 0
+        # Beta cut-offs, by the index of the move causing them in the node's ordered moves
+        self.cutoffs = collections.Counter()
+        self.transposition_hits = 0
+        # Leaves whose evaluation was found in an EvaluationCache
+        self.evaluation_cache_hits = 0
+        # States searched past the search depth by selective deepening, and nodes cut by ProbCut
+        self.extensions = 0
+        self.probcut_cuts = 0
+        # Whether the opponent played the reply the player pondered on, so the search reused the pondered work
+        self.ponder_hit = False
+        # The deepest iteration completed
+        self.depth = 0
+        self.phase_times = {MOVE_GENERATION: 0.0, EVALUATION: 0.0, MAKE_MOVE: 0.0}
+        self.start = time.time()
+        self.end = None
+
+    def timed(self, phase, func, *args):
+        """Calls func(*args), adding its running time to the given phase."""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.phase_times[phase] += time.perf_counter() - start
+
+    def stop(self):
+        self.end = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        """The stats as a JSON friendly dict."""
+        return {
+            'nodes': self.nodes,
+            'leaves': self.leaves,
+            'cutoffs': {str(i): n for i, n in sorted(self.cutoffs.items())},
+            'transposition_hits': self.transposition_hits,
+            'evaluation_cache_hits': self.evaluation_cache_hits,
+            'extensions': self.extensions,
+            'probcut_cuts': self.probcut_cuts,
+            'ponder_hit': self.ponder_hit,
+            'depth': self.depth,
+            'elapsed': self.elapsed,
+            'nodes_per_second': self.nodes_per_second,
+            'phase_times': dict(self.phase_times),
+        }
+
+
+def _depth_hook(selective_deepening):
+    """Returns the selective_deepening hook as a function of (state, depth). Hooks that declare takes_depth get the
+    depth, the others are called with the state alone, as they always were.
+    """
+    if selective_deepening is None or getattr(selective_deepening, 'takes_depth', False):
+        return selective_deepening
+    return lambda state, depth: selective_deepening(state)
 
 
 class MiniMaxAlgorithm:
 
-    def __init__(self, utility, my_color, no_more_time, selective_deepening):
+    def __init__(self, utility, my_color, no_more_time, selective_deepening, stats=None):
         """Initialize a MiniMax algorithms without alpha-beta pruning.
 
         :param utility: The utility function. Should have state as parameter.
@@ -77,12 +341,16 @@ class MiniMaxAlgorithm:
         :param selective_deepening: A functions that gets the current state, and
                         returns True when the algorithm should continue the search
                         for the minimax value recursivly from this state.
+                        A hook with a true takes_depth attribute (see SelectiveDeepening) also gets the state's depth.
                         optional
+        :param stats: A SearchStats to count the search's work in, optional.
         """
         self.utility = utility
         self.my_color = my_color
         self.no_more_time = no_more_time
         self.selective_deepening = selective_deepening
+        self._deepen = _depth_hook(selective_deepening)
+        self.stats = stats
 
     def search(self, state, depth, maximizing_player = True):
         """Start the MiniMax algorithm.
@@ -92,11 +360,15 @@ class MiniMaxAlgorithm:
         :param maximizing_player: Whether this is a max node (True) or a min node (False).
         :return: A tuple: (The min max algorithm value, The move in case of max node or None in min mode)
         """
-        depth_exceeded = depth <= 0 and not (self.selective_deepening and self.selective_deepening(state));
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+
+        depth_exceeded = depth <= 0 and not (self._deepen and self._deepen(state, depth));
         if depth_exceeded:
-            return (self.utility(state), None)
+            return (_evaluate(self.utility, state, stats), None)
         state.curr_player = self.my_color if maximizing_player else OPPONENT_COLOR[self.my_color]
-        moves = state.get_possible_moves()
+        moves = state.get_possible_moves() if stats is None else stats.timed(MOVE_GENERATION, state.get_possible_moves)
         if len(moves) == 0: # todo TIES
             winner = state.get_winner()
 
@@ -106,23 +378,237 @@ class MiniMaxAlgorithm:
         my_turn = maximizing_player # state.curr_player == self.my_color
         f = max if my_turn else min
         
-        child_res = ((self.search(_expand_state(state, m), depth-1, not maximizing_player)[0], m) for m in moves)
+        child_res = (_search_child(state, m, stats, self.search, depth-1, not maximizing_player) for m in moves)
         child_res = provide_while(child_res, self.no_more_time)
 
         val = f(child_res, key=lambda t: t[0], default=(-INFINITY if my_turn else INFINITY, None))
         return val if my_turn else (val[0], None)
 
-def _expand_state(state, move):
-    state = copy.deepcopy(state)
-    state.perform_move(move[0], move[1])
-    return state
+def _search_child(state, move, stats, search, *args):
+    """Searches the child reached by the given move, making the move in place and taking it back afterwards.
+
+    :param stats: The search's SearchStats, or None.
+    :return: A tuple: (The child's value, The move)
+    """
+    undo = state.make_move(move[0], move[1]) if stats is None else stats.timed(MAKE_MOVE, state.make_move, *move)
+    try:
+        return search(state, *args)[0], move
+    finally:
+        if stats is None:
+            state.unmake_move(undo)
+        else:
+            stats.timed(MAKE_MOVE, state.unmake_move, undo)
+
+
+def _evaluate(utility, state, stats):
+    """Evaluates a leaf, counting it in the stats if there are any."""
+    if stats is None:
+        return utility(state)
+    stats.leaves += 1
+    return stats.timed(EVALUATION, utility, state)
 
 ALPHA = 'alpha'
 BETA = 'beta'
 
+# Bound types of transposition table values
+EXACT = 'exact'
+LOWER_BOUND = 'lower'
+UPPER_BOUND = 'upper'
+
+TranspositionEntry = collections.namedtuple('TranspositionEntry', ['key', 'depth', 'bound', 'value', 'move', 'age'])
+
+
+class TranspositionTable:
+    # Rough size in bytes of one stored entry (the namedtuple, its key, value and move), used for the memory cap.
+    ENTRY_SIZE = 300
+
+    def __init__(self, max_memory=16 * 1024 * 1024):
+        """Initialize a fixed size transposition table.
+
+        Each bucket has two slots: a depth-preferred slot, which keeps the deepest search of the current age,
+        and an always-replace slot, which takes everything the depth-preferred slot refuses.
+
+        :param max_memory: The memory cap of the table in bytes. The table gets the largest power of 2 buckets
+                           that fits in it.
+        """
+        n = 1
+        while 2 * n * 2 * self.ENTRY_SIZE <= max_memory:
+            n *= 2
+        self._mask = n - 1
+        self._depth_preferred = [None] * n
+        self._always_replace = [None] * n
+        self.age = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def __len__(self):
+        return len(self._depth_preferred)
+
+    def new_search(self):
+        """Marks the stored entries as old, so the depth-preferred slots can be taken by the next search."""
+        self.age += 1
+
+    def clear(self):
+        n = len(self._depth_preferred)
+        self._depth_preferred = [None] * n
+        self._always_replace = [None] * n
+        self.hits = self.misses = self.collisions = 0
+
+    def lookup(self, key):
+        """Returns the entry stored for the given position key, or None.
+        """
+        i = key & self._mask
+        entry = self._depth_preferred[i]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        other = self._always_replace[i]
+        if other is not None and other.key == key:
+            self.hits += 1
+            return other
+
+        self.misses += 1
+        if entry is not None or other is not None:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, bound, value, move):
+        i = key & self._mask
+        entry = TranspositionEntry(key, depth, bound, value, move, self.age)
+        current = self._depth_preferred[i]
+        if current is None or current.key == key or current.age != self.age or current.depth <= depth:
+            self._depth_preferred[i] = entry
+        else:
+            self._always_replace[i] = entry
+
+
+class EvaluationCache:
+
+    def __init__(self, utility, max_entries=100000, persistent=True):
+        """Memoizes a utility function by position key (the Zobrist key, which includes the player to move), so a
+        position reached again - by the next iteration of iterative deepening, or through a transposition - is
+        evaluated once. Past max_entries, the least recently used entry is evicted.
+
+        :param utility: The utility function. Its value must depend only on the position.
+        :param max_entries: The maximum number of cached values.
+        :param persistent: Whether the values are kept from one move to the next (see new_search). They stay right,
+                           as the utility doesn't change during the game.
+        """
+        self.utility = utility
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self._values = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, state):
+        key = state.zobrist_key
+        values = self._values
+        value = values.get(key)
+        if value is not None:
+            values.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = values[key] = self.utility(state)
+        if len(values) > self.max_entries:
+            values.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._values)
+
+    def new_search(self):
+        """Called before each move's search. A cache that is not persistent starts over."""
+        if not self.persistent:
+            self._values.clear()
+
+    def clear(self):
+        self._values.clear()
+        self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+
+class MoveOrdering:
+
+    def __init__(self, hash_move=True, killers=True, history=True, static_weights=None):
+        """Initialize a move ordering for alpha-beta search. Every stage can be switched off to measure its effect.
+
+        Moves are tried in this order: the hash move (the best move stored for the position by the previous
+        iteration, taken from the transposition table), the killer moves of the ply, then by history heuristic
+        score, then by static weight.
+
+        :param hash_move: Whether to try the transposition table's best move first.
+        :param killers: Whether to keep 2 killer moves (moves that caused a cut-off) per ply.
+        :param history: Whether to keep a history heuristic table (cut-offs weighted by depth^2) per color.
+        :param static_weights: An 8x8 table of square weights, indexed [x][y], or None for no static ordering.
+        """
+        self.hash_move = hash_move
+        self.killers = [[None, None] for _ in range(BOARD_ROWS * BOARD_COLS + 1)] if killers else None
+        self.history = {color: [0] * (BOARD_ROWS * BOARD_COLS) for color in OPPONENT_COLOR} if history else None
+        self.static_weights = static_weights
+
+    def new_search(self):
+        """Forgets the killers and ages the history scores. Call before each move's search."""
+        if self.killers is not None:
+            for ply_killers in self.killers:
+                ply_killers[0] = ply_killers[1] = None
+        if self.history is not None:
+            for scores in self.history.values():
+                for i in range(len(scores)):
+                    scores[i] //= 2
+
+    def order(self, state, moves, hash_move=None):
+        """Returns the given moves sorted best first.
+
+        :param state: The state the moves are played from.
+        :param moves: The possible moves.
+        :param hash_move: The best move found for this position by an earlier search, or None.
+        """
+        hash_move = hash_move if self.hash_move else None
+        killers = self.killers[state.disc_count] if self.killers is not None else (None, None)
+        history = self.history[state.curr_player] if self.history is not None else None
+        weights = self.static_weights
+
+        def key(move):
+            return (move == hash_move,
+                    2 if move == killers[0] else (1 if move == killers[1] else 0),
+                    history[move[0] * BOARD_ROWS + move[1]] if history is not None else 0,
+                    weights[move[0]][move[1]] if weights is not None else 0)
+
+        return sorted(moves, key=key, reverse=True)
+
+    def record_cutoff(self, state, move, depth):
+        """Records a move that caused a beta cut-off in the given state, searched to the given depth."""
+        if self.killers is not None:
+            ply_killers = self.killers[state.disc_count]
+            if ply_killers[0] != move:
+                ply_killers[1] = ply_killers[0]
+                ply_killers[0] = move
+        if self.history is not None:
+            self.history[state.curr_player][move[0] * BOARD_ROWS + move[1]] += depth * depth
+
+
+def _bound_type(value, alpha, beta):
+    if value <= alpha:
+        return UPPER_BOUND
+    if value >= beta:
+        return LOWER_BOUND
+    return EXACT
+
+
 class MiniMaxWithAlphaBetaPruning:
 
-    def __init__(self, utility, my_color, no_more_time, selective_deepening):
+    def __init__(self, utility, my_color, no_more_time, selective_deepening, transposition_table=None,
+                 move_ordering=None, stats=None):
         """Initialize a MiniMax algorithms with alpha-beta pruning.
 
         :param utility: The utility function. Should have state as parameter.
@@ -132,11 +618,20 @@ class MiniMaxWithAlphaBetaPruning:
         :param selective_deepening: A functions that gets the current state, and
                         returns True when the algorithm should continue the search
                         for the minimax value recursivly from this state.
+                        A hook with a true takes_depth attribute (see SelectiveDeepening) also gets the state's depth.
+        :param transposition_table: A TranspositionTable to cache searched positions in, optional.
+                        It may be shared between searches of the same player (the values are from its point of view).
+        :param move_ordering: A MoveOrdering to sort the moves of each node with, optional.
+        :param stats: A SearchStats to count the search's work in, optional.
         """
         self.utility = utility
         self.my_color = my_color
         self.no_more_time = no_more_time
         self.selective_deepening = selective_deepening
+        self._deepen = _depth_hook(selective_deepening)
+        self.transposition_table = transposition_table
+        self.move_ordering = move_ordering
+        self.stats = stats
 
     def search(self, state, depth, alpha=-INFINITY, beta=+INFINITY, maximizing_player=True):
         """Start the MiniMax algorithm.
@@ -148,13 +643,33 @@ class MiniMaxWithAlphaBetaPruning:
         :param maximizing_player: Whether this is a max node (True) or a min node (False).
         :return: A tuple: (The alpha-beta algorithm value, The move in case of max node or None in min mode)
         """
-        depth_exceeded = depth <= 0 and not (self.selective_deepening and self.selective_deepening(state));
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+
+        depth_exceeded = depth <= 0 and not (self._deepen and self._deepen(state, depth));
         state.curr_player = self.my_color if maximizing_player else OPPONENT_COLOR[self.my_color]
-        moves = state.get_possible_moves()
+        my_turn = maximizing_player # state.curr_player == self.my_color
+
+        table = self.transposition_table
+        entry = None
+        if table is not None and not depth_exceeded:
+            entry = table.lookup(state.zobrist_key)
+            if entry is not None and stats is not None:
+                stats.transposition_hits += 1
+            if entry is not None and entry.depth >= depth and (
+                    entry.bound == EXACT or
+                    (entry.bound == LOWER_BOUND and entry.value >= beta) or
+                    (entry.bound == UPPER_BOUND and entry.value <= alpha)):
+                return (entry.value, entry.move if my_turn else None)
+
+        moves = state.get_possible_moves() if stats is None else stats.timed(MOVE_GENERATION, state.get_possible_moves)
         if depth_exceeded or len(moves) == 0:
-            return (self.utility(state), None)
+            return (_evaluate(self.utility, state, stats), None)
+
+        if self.move_ordering is not None:
+            moves = self.move_ordering.order(state, moves, entry.move if entry is not None else None)
 
-        my_turn = maximizing_player # state.curr_player == self.my_color
         f = max if my_turn else min
         target_param = ALPHA if my_turn else BETA
 
@@ -162,58 +677,266 @@ class MiniMaxWithAlphaBetaPruning:
         params[ALPHA] = alpha
         params[BETA] = beta
 
-        child_res = ((self.search(_expand_state(state, m), depth-1, params[ALPHA], params[BETA], not maximizing_player)[0], m) for m in moves)
+        # The pruning check has to run before a child is searched, so the child causing the cut-off is still counted.
+        ordered_moves = moves
+        moves = provide_while(moves, lambda: params[BETA] <= params[ALPHA]) # Alpha-Beta Pruning
+        child_res = (_search_child(state, m, stats, self.search, depth-1, params[ALPHA], params[BETA], not maximizing_player) for m in moves)
         child_res = after_each(child_res, lambda v: operator.setitem(params, target_param, f(params[target_param], v[0])))
-        child_res = provide_while(child_res, lambda: params[BETA] <= params[ALPHA]) # Alpha-Beta Pruning
         child_res = provide_while(child_res, self.no_more_time)
 
         val = f(child_res, key=lambda t: t[0], default=(-INFINITY if my_turn else INFINITY, None))
+
+        # A search cut by the time limit didn't see all the moves it needed, so its value is not stored.
+        if val[1] is not None and not self.no_more_time():
+            if table is not None:
+                table.store(state.zobrist_key, depth, _bound_type(val[0], alpha, beta), val[0], val[1])
+            if params[BETA] <= params[ALPHA]:
+                # The best move is the one that caused the cut-off
+                if self.move_ordering is not None:
+                    self.move_ordering.record_cutoff(state, val[1], depth)
+                if stats is not None:
+                    stats.cutoffs[ordered_moves.index(val[1])] += 1
+
         return val if my_turn else (val[0], None)
 
-def after_each(iter, post_process):
-    for i in iter:     
-        post_process(i)
-        yield i
+# Scores closer than this are considered equal by the null-window searches
+NULL_WINDOW = 1e-4
 
-def provide_while(iter, stop):
-    for i in iter:
-        if stop():
-            return
-        
-        yield i
 
-# Extarct the most popular moves with their ranking
-def ExtractMostPopularOpenningMoves(n):
+class PrincipalVariationSearch:
 
-    book = open("book.gam", "r")
-    moves = []
+    def __init__(self, utility, my_color, no_more_time, selective_deepening, transposition_table=None,
+                 move_ordering=None, aspiration_window=1000.0, probcut=None, stats=None):
+        """Initialize a Principal Variation Search (NegaScout). A negamax alpha-beta search where only the first
+        move of each node gets the full window, and the rest are refuted by null-window searches.
 
-    for line in book:
-        moves.append(line[:30])
+        :param utility: The utility function. Should have state as parameter.
+        :param my_color: The color of the player who runs this search.
+        :param no_more_time: A function that returns true if there is no more time to run this search, or false if
+                             there is still time left.
+        :param selective_deepening: A functions that gets the current state, and
+                        returns True when the algorithm should continue the search
+                        for the minimax value recursivly from this state.
+                        A hook with a true takes_depth attribute (see SelectiveDeepening) also gets the state's depth.
+        :param transposition_table: A TranspositionTable to cache searched positions in, optional.
+                        Values are stored from the point of view of the player to move, so the table must not be
+                        shared with MiniMaxWithAlphaBetaPruning.
+        :param move_ordering: A MoveOrdering to sort the moves of each node with, optional.
+        :param aspiration_window: Half the width of the root window around the score expected from the previous
+                        iterations, or None to always search the root with the given window.
+        :param probcut: A ProbCut to cut nodes by shallow searches with, optional.
+        :param stats: A SearchStats to count the search's work in, optional.
+        """
+        self.utility = utility
+        self.my_color = my_color
+        self.no_more_time = no_more_time
+        self.selective_deepening = selective_deepening
+        self._deepen = _depth_hook(selective_deepening)
+        self.transposition_table = transposition_table
+        self.move_ordering = move_ordering
+        self.aspiration_window = aspiration_window
+        self.probcut = probcut
+        self.stats = stats
+
+        # Root scores of the completed iterations, by depth
+        self._scores = {}
+        # The depth of the root of the current search, which ProbCut must not cut
+        self._root_depth = None
 
-    moves.sort()
-    counter = collections.Counter(moves)
-    top_n_moves = _MirrorBook(sorted(counter, key=counter.get, reverse=True)[:n])
+    def search(self, state, depth, alpha=-INFINITY, beta=+INFINITY, maximizing_player=True):
+        """Start the search. Meant to be called with increasing depths (iterative deepening), the previous
+        iterations' scores are used for the aspiration window.
 
-    top_n_moves_dict = {}
+        :param state: The state to start from.
+        :param depth: The maximum allowed depth for the algorithm.
+        :param alpha: The alpha of the alpha-beta pruning.
+        :param beta: The beta of the alpha-beta pruning.
+        :param maximizing_player: Whether this is a max node (True) or a min node (False).
+        :return: A tuple: (The search value, The move in case of max node or None in min mode)
+        """
+        state.curr_player = self.my_color if maximizing_player else OPPONENT_COLOR[self.my_color]
+        self._root_depth = depth
+        # Negamax values are from the point of view of the player to move
+        if not maximizing_player:
+            alpha, beta = -beta, -alpha
+
+        # The evaluation swings between odd and even depths, so aim at the last score of the same parity.
+        expected = self._scores.get(depth - 2, self._scores.get(depth - 1))
+        if self.aspiration_window is not None and expected is not None:
+            window_alpha = max(alpha, expected - self.aspiration_window)
+            window_beta = min(beta, expected + self.aspiration_window)
+            value, move = self._search(state, depth, window_alpha, window_beta)
+            # Failed low or high - search again with the window open on the failing side
+            if value <= window_alpha and window_alpha > alpha:
+                value, move = self._search(state, depth, alpha, window_beta)
+            elif value >= window_beta and window_beta < beta:
+                value, move = self._search(state, depth, window_alpha, beta)
+        else:
+            value, move = self._search(state, depth, alpha, beta)
+
+        if not self.no_more_time():
+            self._scores[depth] = value
+
+        return (value, move) if maximizing_player else (-value, None)
+
+    def _evaluate(self, state):
+        value = _evaluate(self.utility, state, self.stats)
+        return value if state.curr_player == self.my_color else -value
+
+    def _search(self, state, depth, alpha, beta):
+        """The negamax PVS, fail-soft.
+
+        :return: A tuple: (The value for the player to move, The best move)
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+
+        if depth <= 0 and not (self._deepen and self._deepen(state, depth)):
+            return self._evaluate(state), None
+
+        table = self.transposition_table
+        entry = None
+        if table is not None:
+            entry = table.lookup(state.zobrist_key)
+            if entry is not None and stats is not None:
+                stats.transposition_hits += 1
+            if entry is not None and entry.depth >= depth and (
+                    entry.bound == EXACT or
+                    (entry.bound == LOWER_BOUND and entry.value >= beta) or
+                    (entry.bound == UPPER_BOUND and entry.value <= alpha)):
+                return entry.value, entry.move
+
+        probcut = self.probcut
+        if probcut is not None and probcut.min_depth <= depth < self._root_depth:
+            value = probcut.cut(self._search, state, depth, alpha, beta)
+            if value is not None:
+                return value, None
+
+        moves = state.get_possible_moves() if stats is None else stats.timed(MOVE_GENERATION, state.get_possible_moves)
+        if len(moves) == 0:
+            return self._evaluate(state), None
+
+        if self.move_ordering is not None:
+            moves = self.move_ordering.order(state, moves, entry.move if entry is not None else None)
+
+        best_value, best_move = -INFINITY, None
+        window_alpha = alpha
+        for i, move in enumerate(moves):
+            if i > 0 and self.no_more_time():
+                break
+
+            undo = state.make_move(move[0], move[1]) if stats is None else stats.timed(MAKE_MOVE, state.make_move, *move)
+            try:
+                if i == 0:
+                    value = -self._search(state, depth - 1, -beta, -window_alpha)[0]
+                else:
+                    # Null window: only prove the move is not better than the best so far
+                    value = -self._search(state, depth - 1, -window_alpha - NULL_WINDOW, -window_alpha)[0]
+                    if window_alpha < value < beta:
+                        value = -self._search(state, depth - 1, -beta, -value)[0]
+            finally:
+                if stats is None:
+                    state.unmake_move(undo)
+                else:
+                    stats.timed(MAKE_MOVE, state.unmake_move, undo)
+
+            if best_move is None or value > best_value:
+                best_value, best_move = value, move
+                window_alpha = max(window_alpha, value)
+                if value >= beta:
+                    if self.move_ordering is not None:
+                        self.move_ordering.record_cutoff(state, move, depth)
+                    if stats is not None:
+                        stats.cutoffs[i] += 1
+                    break
+
+        # A search cut by the time limit didn't see all the moves it needed, so its value is not stored.
+        if table is not None and not self.no_more_time():
+            table.store(state.zobrist_key, depth, _bound_type(best_value, alpha, beta), best_value, best_move)
+
+        return best_value, best_move
+
+class SelectiveDeepening:
+    # The searches pass the state's remaining depth: 0 or less, minus the plies it's already past the search depth
+    takes_depth = True
+
+    def __init__(self, criterion, max_plies=2, max_nodes=0):
+        """A selective_deepening function for the search algorithms: continues the search past its depth from the
+        states the criterion picks, within a budget, so the extensions can't explode.
+
+        A state is extended by 2 plies, so the leaves under it are evaluated with the same player to move as the
+        other leaves - evaluations tend to favor the player who moved last, and mixing the two skews the search.
+
+        :param criterion: A function that gets a state, and returns True if it should be searched deeper.
+        :param max_plies: How many plies past the search depth a line may be extended.
+        :param max_nodes: How many states may be extended per move (see new_search). Each costs about a full 2 ply
+                          search under it. 0 (the default) extends nothing.
+        """
+        self.criterion = criterion
+        self.max_plies = max_plies
+        self.max_nodes = max_nodes
+        self.extensions = 0
+
+    def __call__(self, state, depth=0):
+        """The selective_deepening hook. Callers that don't pass the depth get the criterion and the budget only."""
+        if -depth >= self.max_plies:
+            return False
+        if -depth % 2:
+            # The second ply of an extension
+            return True
+        if self.extensions >= self.max_nodes or not self.criterion(state):
+            return False
+        self.extensions += 1
+        return True
+
+    def new_search(self):
+        """Called before each move's search, to renew the budget."""
+        self.extensions = 0
+
+
+class ProbCut:
+
+    def __init__(self, margin, reduction=2, min_depth=3):
+        """ProbCut for PrincipalVariationSearch: a shallow search of a node predicts its deep search. When the
+        shallow value is past the window by more than the margin, the deep search would almost surely fail the same
+        way, so the node is cut without it.
+
+        :param margin: In the utility's units. About 1.5 to 2 standard deviations of the difference between the
+                       values of a search and of one `reduction` plies shallower.
+        :param reduction: How much shallower the predicting search is.
+        :param min_depth: Nodes with less depth left are searched in full.
+        """
+        self.margin = margin
+        self.reduction = reduction
+        self.min_depth = min_depth
+        self.cuts = 0
 
-    for l in range(0, 28, 3):
-        for item in top_n_moves:
-            if item[:l]not in top_n_moves_dict.keys():top_n_moves_dict[item[:l]] = item[l:l+3]
+    def cut(self, search, state, depth, alpha, beta):
+        """Tries to cut a node by null-window searches around alpha - margin and beta + margin.
 
-    return top_n_moves_dict
+        :param search: The negamax search: search(state, depth, alpha, beta) -> (value, move).
+        :return: The bound the node fails on (beta if high, alpha if low), or None if it has to be searched.
+        """
+        bound = beta + self.margin
+        if bound < INFINITY and search(state, depth - self.reduction, bound - NULL_WINDOW, bound)[0] >= bound:
+            self.cuts += 1
+            return beta
+        bound = alpha - self.margin
+        if bound > -INFINITY and search(state, depth - self.reduction, bound, bound + NULL_WINDOW)[0] <= bound:
+            self.cuts += 1
+            return alpha
+        return None
 
-def _MirrorBook(top_n_moves):
-    dict = {'a' : 'h', 'b':'g', 'c':'f', 'd':'e','e': 'd', 'f': 'c','g':'b','h':'a'}
-    shift_top_n_move = []
-    for move in top_n_moves:
-        temp = ''
-        for c in move:
 
-            if c.isalpha():
-                temp+= dict[c]
-            else:
-                temp += c
-        shift_top_n_move.append(temp)
+def after_each(iter, post_process):
+    for i in iter:     
+        post_process(i)
+        yield i
 
-    return shift_top_n_move
\ No newline at end of file
+def provide_while(iter, stop):
+    for i in iter:
+        if stop():
+            return
+        
+        yield i